@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Benchmark of the scraping pipeline.
+
+Every page of benchmarks/corpus and a generated news page of about 5 MB goes through
+the stages of a fetch one by one:
+
+- decode: TextDecoder over the raw bytes, chunk by chunk like download() does
+- tree: parse_tree on the decoded text
+- extract: the domain parser or readability on the tree
+- sanitize: bleach_article on the extracted article
+
+For every stage the minimum and median time of several runs and the peak of memory
+allocated by Python during one more run are reported. Memory allocated by libxml2 is not
+seen by tracemalloc.
+
+    python benchmarks/bench_scrapers.py --repeat 5 --json before.json
+    python benchmarks/bench_scrapers.py --repeat 5 --compare before.json
+"""
+from argparse import ArgumentParser
+from os import path
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+CORPUS = path.join(path.dirname(path.abspath(__file__)), 'corpus')
+sys.path.insert(0, ROOT)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pypo.settings')
+
+import django
+django.setup()
+
+from readme.download import TextDecoder, CHUNK_SIZE
+from readme.models import Item, bleach_article
+from readme.scrapers import parse, parse_tree, parse_web_page
+
+# file name -> url of the page, the url decides which parser is used
+PAGES = {
+    'blog_post.html': 'http://blog.example.com/2015/03/notes-on-slow-queries/',
+    'github_readme.html': 'https://github.com/audax/pypo',
+    'latin1_news.html': 'http://www.example.de/lokales/strassenbahn.html',
+}
+LARGE_PAGE_SIZE = 5 * 1024 * 1024
+
+
+def load_corpus():
+    """
+    :return: list of (name, url, raw bytes)
+    """
+    pages = []
+    for name, url in sorted(PAGES.items()):
+        with open(path.join(CORPUS, name), 'rb') as f:
+            pages.append((name, url, f.read()))
+    pages.append(('generated_news.html', 'http://news.example.com/live', generate_news_page(LARGE_PAGE_SIZE)))
+    return pages
+
+
+def generate_news_page(size):
+    """
+    A long news page with navigation, many teasers and comments, like a live blog
+    that nobody archived for a while.
+
+    :param size: length in bytes
+    :return: bytes
+    """
+    head = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>Live: the news of the day</title>'
+            '<script>var ads = [];</script></head><body><nav><ul>{}</ul></nav><div id="live">'
+            .format(''.join('<li><a href="/section/{0}">Section {0}</a></li>'.format(i) for i in range(50))))
+    tail = '</div><footer>Imprint</footer></body></html>'
+    blocks = []
+    length = len(head) + len(tail)
+    i = 0
+    while length < size:
+        block = ('<div class="entry" id="entry-{0}"><h2>Update {0}: Die Straßenbahn fährt wieder</h2>'
+                 '<p class="time">{1:02d}:{2:02d}</p><p>Reporters on site say the situation is calm. '
+                 'The city announced further measures for the coming days, details are expected in '
+                 'the afternoon. <a href="/entry/{0}">Read more</a></p>'
+                 '<div class="comments"><p>Comment {0}: thanks for the update!</p></div></div>'
+                 .format(i, i // 60 % 24, i % 60))
+        blocks.append(block)
+        length += len(block.encode('utf-8'))
+        i += 1
+    return (head + ''.join(blocks) + tail).encode('utf-8')
+
+
+def decode(raw):
+    decoder = TextDecoder(None)
+    for start in range(0, len(raw), CHUNK_SIZE):
+        decoder.feed(raw[start:start + CHUNK_SIZE])
+    return decoder.finish()
+
+
+def extract(url, tree):
+    parser = parse.registry.find(url)
+    if parser is None:
+        return parse_web_page(tree)
+    return parser(Item(url=url), 'text/html', tree)
+
+
+def measure(func, setup, repeat):
+    """
+    :param func: called with the result of setup
+    :param setup: called before every run, not measured
+    :return: dict with min and median seconds and the peak of allocated bytes
+    """
+    timings = []
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    arg = setup()
+    tracemalloc.start()
+    try:
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'min': min(timings), 'median': statistics.median(timings), 'peak_memory': peak}
+
+
+def run(repeat):
+    results = []
+    for name, url, raw in load_corpus():
+        text = decode(raw)
+        _, article = extract(url, parse_tree(text))
+        stages = [
+            ('decode', decode, lambda: raw),
+            ('tree', parse_tree, lambda: text),
+            # parsers may modify the tree, so every run gets a new one
+            ('extract', lambda tree: extract(url, tree), lambda: parse_tree(text)),
+            ('sanitize', bleach_article, lambda: article),
+        ]
+        for stage, func, setup in stages:
+            result = measure(func, setup, repeat)
+            result.update(page=name, stage=stage, bytes=len(raw))
+            results.append(result)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    baseline = {(r['page'], r['stage']): r for r in (baseline or [])}
+    print('{:<22} {:<9} {:>9} {:>11} {:>11} {:>10} {:>8}'.format(
+        'page', 'stage', 'KB', 'min ms', 'median ms', 'peak KB', 'change'))
+    for r in results:
+        old = baseline.get((r['page'], r['stage']))
+        change = '{:+.0%}'.format(r['median'] / old['median'] - 1) if old else ''
+        print('{:<22} {:<9} {:>9.0f} {:>11.2f} {:>11.2f} {:>10.0f} {:>8}'.format(
+            r['page'], r['stage'], r['bytes'] / 1024, r['min'] * 1000, r['median'] * 1000,
+            r['peak_memory'] / 1024, change))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='runs per stage (default: 5)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='show the change of the median against the results in this file')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commit': git_commit(), 'python': platform.python_version(),
+                       'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
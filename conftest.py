@@ -8,6 +8,7 @@ from rest_framework.test import APIClient
 from django.core.management import call_command
 from unittest.mock import patch, Mock
 from readme.models import User, Item
+from readme.scheduler import DomainScheduler
 
 from django.conf import settings
 
@@ -15,11 +16,22 @@ def pytest_configure():
     # workaround to avoid django pipeline issue
     # refers to
     settings.STATICFILES_STORAGE = 'pipeline.storage.PipelineStorage'
+    # tests search for items right after saving them
+    settings.PYPO_INDEX_IN_BACKGROUND = False
 
 QUEEN = 'queen with spaces änd umlauts'
 EXAMPLE_COM = 'http://www.example.com/'
 
 
+@pytest.fixture(autouse=True)
+def domain_scheduler(monkeypatch):
+    """
+    Fresh rate limits and circuit breakers for every test
+    """
+    scheduler = DomainScheduler()
+    monkeypatch.setattr('readme.models.domain_scheduler', scheduler)
+    return scheduler
+
 @pytest.fixture
 def user(db):
     try:
@@ -92,11 +104,11 @@ def clear_index():
 
 @pytest.fixture
 def get_mock(request, clear_index):
-    patcher = patch('requests.get')
+    patcher = patch('requests.Session.get')
     get_mock = patcher.start()
     return_mock = Mock(headers={'content-type': 'text/html',
                                 'content-length': 500},
-                       encoding='utf-8')
+                       encoding='utf-8', status_code=200)
     return_mock.iter_content.return_value = iter([b"example.com"])
     get_mock.return_value = return_mock
 
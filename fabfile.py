@@ -42,6 +42,12 @@ def _update_database(source_folder):
     run('cd %s && ../virtualenv/bin/python3 manage.py migrate --noinput' % (
         source_folder,
         ))
+    run('cd %s && ../virtualenv/bin/python3 manage.py backfill_items' % (
+        source_folder,
+        ))
+    run('cd %s && ../virtualenv/bin/python3 manage.py rebuild_tag_counts' % (
+        source_folder,
+        ))
 
 def _get_latest_source(source_folder):
     if exists(path.join(source_folder, '.git')):
@@ -54,8 +60,17 @@ def _get_latest_source(source_folder):
 def reload_wsgi():
     run("sudo service {}.gunicorn restart".format(env.host))
 
-def update_index():
+def reload_fetch_workers():
+    run("sudo service {}.fetch-workers restart".format(env.host))
+
+def reload_indexer():
+    run("sudo service {}.indexer restart".format(env.host))
+
+def update_index(age=24):
+    # indexes the items modified in the last age hours, fab update_index:age=0 indexes all items
     source_folder = path.join(SITES_FOLDER, env.host, 'source')
-    run('cd %s && ../virtualenv/bin/python3 manage.py update_index' % (
+    age_option = ' --age %s' % age if float(age) else ''
+    run('cd %s && ../virtualenv/bin/python3 manage.py reindex_items%s' % (
         source_folder,
+        age_option,
         ))
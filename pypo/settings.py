@@ -269,7 +269,7 @@ HAYSTACK_CONNECTIONS = {
     },
 }
 
-HAYSTACK_SIGNAL_PROCESSOR = 'readme.signals.ItemOnlySignalProcessor'
+HAYSTACK_SIGNAL_PROCESSOR = 'readme.signals.QueuedSignalProcessor'
 
 REST_FRAMEWORK = {
     # Use hyperlinked styles by default.
@@ -291,6 +291,53 @@ TEMPLATE_VISIBLE_SETTINGS = ('PYPO_DEFAULT_THEME',)
 # 10MB
 PYPO_MAX_CONTENT_LENGTH = int(1.049e+7)
 
+# Download articles of new items with manage.py run_fetch_workers instead of during the request
+PYPO_FETCH_IN_BACKGROUND = True
+# Seconds after which a started fetch job is considered abandoned and is claimed again
+PYPO_FETCH_JOB_TIMEOUT = 300
+# How often a fetch job is tried before the item is marked as failed
+PYPO_FETCH_JOB_MAX_ATTEMPTS = 3
+
+# Requests per second and burst size allowed for each domain
+PYPO_DOMAIN_RATE = 1.0
+PYPO_DOMAIN_BURST = 5
+# Domains with this many timeouts or server errors in a row are not tried again for PYPO_DOMAIN_RETRY_AFTER seconds
+PYPO_DOMAIN_FAILURE_THRESHOLD = 3
+PYPO_DOMAIN_RETRY_AFTER = 300
+# Seconds a url that timed out or failed with a server error is not downloaded again
+PYPO_FAILED_URL_TTL = 600
+
+# Seconds a downloaded page is shared with other users that save the same url
+PYPO_DOCUMENT_MAX_AGE = 60 * 60 * 24
+
+# Keep the compressed raw content of every page, so manage.py reextract can parse it again without downloading it
+PYPO_STORE_SNAPSHOTS = True
+
+# Directory for raw downloaded pages, used to send conditional requests when refetching. None disables it
+PYPO_RESPONSE_CACHE_DIR = path.join(PROJECT_ROOT, 'response_cache')
+# Number of pages kept in PYPO_RESPONSE_CACHE_DIR, the least recently used ones are deleted. None keeps all
+PYPO_RESPONSE_CACHE_MAX_ENTRIES = 10000
+
+# Seconds a single fetch may take from connecting to the end of the download, parsing the page
+# afterwards is not included
+PYPO_FETCH_DEADLINE = 30
+# Pages cut off by PYPO_FETCH_DEADLINE are still parsed if at least this many bytes arrived
+PYPO_FETCH_MIN_PARTIAL_LENGTH = 4 * 1024
+
+# Number of processes that parse downloaded pages, 0 parses them in the fetching process
+PYPO_PARSER_PROCESSES = 0
+# Seconds of cpu time a single page may take to parse
+PYPO_PARSER_TIMEOUT = 10
+# Bytes of address space for each parser process and number of pages it parses before it is replaced
+PYPO_PARSER_MEMORY_LIMIT = 1024 ** 3
+PYPO_PARSER_MAX_TASKS = 100
+
+# Record changed items for manage.py run_indexer instead of updating the search index during the request
+PYPO_INDEX_IN_BACKGROUND = True
+
+# Number of items in a page of the item list of the REST API
+PYPO_API_PAGE_SIZE = 100
+
 PYPO_DEFAULT_THEME = 'slate'
 
 PYPO_THEMES = (
@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.http import Http404
 from rest_framework import viewsets
+from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
 from .serializers import ItemSerializer
 from .models import Item
+from .pagination import paginate, InvalidCursor
 
 
 class ItemViewSet(viewsets.ModelViewSet):
@@ -12,9 +17,36 @@ class ItemViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """
-        Filter Items by the current user
+        Filter Items by the current user and optionally by the domain given in ?domain=
+
+        Lists only load the article if it is part of the response, see ItemSerializer.
+        """
+        queryset = Item.objects.filter(owner=self.request.user).order_by('-created').with_tag_names()
+        domain = self.request.query_params.get('domain')
+        if domain:
+            queryset = queryset.filter(domain=domain.lower())
+        if self.action == 'list':
+            fields = ItemSerializer.requested_fields(self.request)
+            queryset = queryset.for_list(with_article=fields is None or 'readable_article' in fields)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        """
+        Newest items first, PYPO_API_PAGE_SIZE per page. The other pages are linked in the
+        Link header with rel="next" for older and rel="prev" for newer items.
         """
-        return Item.objects.filter(owner=self.request.user).order_by('-created').prefetch_related('tags')
+        try:
+            page = paginate(self.filter_queryset(self.get_queryset()), request.query_params.get('cursor'),
+                            settings.PYPO_API_PAGE_SIZE)
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        response = Response(self.get_serializer(page, many=True).data)
+        url = request.build_absolute_uri()
+        links = ['<{}>; rel="{}"'.format(replace_query_param(url, 'cursor', cursor), rel)
+                 for cursor, rel in ((page.next_cursor, 'next'), (page.previous_cursor, 'prev')) if cursor]
+        if links:
+            response['Link'] = ', '.join(links)
+        return response
 
     def perform_create(self, serializer):
         """
@@ -0,0 +1,93 @@
+"""
+Concurrent downloads for jobs that fetch many items at once, like imports or refetching
+all articles.
+"""
+from collections import namedtuple, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+from readme.download import download, Deadline, DownloadException, MIN_PARTIAL_LENGTH
+
+FetchResult = namedtuple('FetchResult', ('item', 'content', 'error'))
+
+
+def _host(url):
+    return urlsplit(url).netloc.lower()
+
+
+def _fetch(item, max_content_length, pool, scheduler, cache, timeout, min_partial_length):
+    fetch = download if scheduler is None else scheduler.download
+    # the deadline starts when a worker picks up the item, not while it waits in the backlog
+    deadline = Deadline(timeout) if timeout is not None else None
+    try:
+        return FetchResult(item, fetch(item.url, max_content_length=max_content_length, pool=pool,
+                                       cache=cache, deadline=deadline,
+                                       min_partial_length=min_partial_length), None)
+    except DownloadException as e:
+        return FetchResult(item, None, e)
+
+
+def fetch_many(items, workers=8, per_host=2, max_pending=1000, max_content_length=1000, pool=None,
+               scheduler=None, cache=None, timeout=None, min_partial_length=MIN_PARTIAL_LENGTH):
+    """
+    Download the urls of many items in parallel and yield the results as they complete.
+
+    At most workers downloads run at the same time and at most per_host of them go to the
+    same host. Items whose host is busy wait in a backlog, the iterable is only consumed
+    while less than max_pending items are waiting, so it can be a lazy queryset iterator.
+
+    :param items: iterable of Items or anything else with an url
+    :param workers: global limit of parallel downloads
+    :param per_host: limit of parallel downloads per host
+    :param max_pending: limit of items that wait for their host
+    :param max_content_length: length in bytes
+    :param pool: SessionPool for download()
+    :param scheduler: optional DomainScheduler that rate limits the downloads
+    :param cache: optional ResponseCache for conditional requests
+    :param timeout: optional seconds each download may take, see download()
+    :param min_partial_length: length in bytes that is enough if a download runs out of time
+    :return: generator of FetchResult(item, content, error), content is a DownloadedContent
+             and error a DownloadException if the download failed
+    """
+    items = iter(items)
+    backlog = defaultdict(deque)
+    waiting = 0
+    active = defaultdict(int)
+    running = {}
+    exhausted = False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def submit(item, host):
+            active[host] += 1
+            running[executor.submit(_fetch, item, max_content_length, pool, scheduler, cache,
+                                   timeout, min_partial_length)] = host
+
+        while True:
+            # keep the executor busy, but don't start more than per_host downloads per host
+            while not exhausted and len(running) < workers and waiting < max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                host = _host(item.url)
+                if active[host] < per_host:
+                    submit(item, host)
+                else:
+                    backlog[host].append(item)
+                    waiting += 1
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                host = running.pop(future)
+                active[host] -= 1
+                if backlog[host]:
+                    submit(backlog[host].popleft(), host)
+                    waiting -= 1
+                else:
+                    del backlog[host]
+                    if not active[host]:
+                        del active[host]
+                yield future.result()
@@ -1,28 +1,331 @@
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit, urlunsplit
+import codecs
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
 import requests
+from requests.adapters import HTTPAdapter
 
 
 class DownloadException(Exception):
 
-    def __init__(self, message, *args, parent=None, **kwargs):
+    def __init__(self, message, *args, parent=None, status_code=None, timed_out=False, **kwargs):
         self.parent = parent
         self.message = message
+        self.status_code = status_code
+        self.timed_out = timed_out
         super(DownloadException, self).__init__(*args, **kwargs)
 
-DownloadedContent = namedtuple('DownloadedContent', ('text', 'content', 'content_type'))
+    @property
+    def is_host_failure(self):
+        """
+        True if the host timed out, refused the connection or had a server error
+        """
+        if self.status_code is not None:
+            return self.status_code >= 500
+        return self.timed_out or isinstance(self.parent, (requests.Timeout, requests.ConnectionError))
 
-def download(url, max_content_length=1000):
+
+class DownloadDeferred(DownloadException):
+    """
+    The download was not tried because its domain is rate limited or failing, or the url failed
+    recently. The url can be tried again after retry_after seconds.
+    """
+
+    def __init__(self, message, retry_after, *args, **kwargs):
+        self.retry_after = retry_after
+        super(DownloadDeferred, self).__init__(message, *args, **kwargs)
+
+
+DownloadedContent = namedtuple('DownloadedContent', ('text', 'content', 'content_type', 'partial', 'encoding'))
+# partial is only set if the download was cut off by its deadline, encoding is the one from the headers
+DownloadedContent.__new__.__defaults__ = (False, None)
+
+
+class Deadline(object):
+    """
+    Point in time at which a fetch has to be finished
+    """
+
+    def __init__(self, seconds, clock=time.monotonic):
+        self.clock = clock
+        self.expires = clock() + seconds
+
+    def remaining(self):
+        """
+        :return: seconds left, 0 if the deadline passed
+        """
+        return max(0, self.expires - self.clock())
+
+    @property
+    def expired(self):
+        return self.clock() >= self.expires
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+# Size of the chunks in which content is streamed
+CHUNK_SIZE = 4 * 1024
+# Number of bytes that are searched for a declared charset
+SNIFF_LENGTH = 4 * 1024
+# Seconds to wait for a connection and between two received packets
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+# Content cut off by a deadline is still used if at least this many bytes arrived
+MIN_PARTIAL_LENGTH = 4 * 1024
+# Number of bytes handed to the prefix callback of download(), enough for the head of most pages
+PREFIX_LENGTH = 8 * 1024
+# Types besides text/* that are decoded to text
+TEXT_TYPES = frozenset(['application/json', 'application/xml', 'application/javascript'])
+# Binary types whose beginning is downloaded for their metadata, mime type -> length in bytes
+PREFIX_TYPES = {'application/pdf': 64 * 1024}
+
+
+def normalize_url(url):
+    """
+    Normalize an url so that different spellings of the same page are equal:
+    lower case scheme and host, no default port, no fragment and at least / as path.
+
+    :param url: Url
+    :return: normalized url
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    host, _, port = netloc.rpartition(':')
+    if host and DEFAULT_PORTS.get(scheme) == port:
+        netloc = host
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def hash_url(url):
+    """
+    Fixed width hash of the normalized url
+
+    :param url: Url
+    :return: hex digest with 40 characters
+    """
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+
+class SessionPool(object):
+    """
+    Process wide pool of keep-alive sessions, one per scheme and host.
+
+    Every session keeps up to connections_per_host open connections, further requests
+    to the same host wait for a free connection. Sessions that were not used for
+    idle_timeout seconds are closed, as are the least recently used ones if more than
+    max_hosts are open. The pool can be shared by threads. The sessions keep no cookies
+    between requests.
+    """
+
+    def __init__(self, connections_per_host=4, max_hosts=100, idle_timeout=60):
+        self.connections_per_host = connections_per_host
+        self.max_hosts = max_hosts
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> [session, last used, number of users], least recently used first
+        self._sessions = OrderedDict()
+
+    def _create_session(self):
+        session = requests.Session()
+        # the session is shared by the fetches of all users, cookies set for one of them must not
+        # be sent with the others. Redirects of a single request still carry their cookies.
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.connections_per_host, pool_block=True)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _evict(self, now):
+        """
+        Remove idle and surplus sessions, must be called with the lock held
+
+        :return: list of removed sessions
+        """
+        evicted = []
+        for key, (session, last_used, users) in list(self._sessions.items()):
+            if users:
+                continue
+            if now - last_used > self.idle_timeout or len(self._sessions) > self.max_hosts:
+                del self._sessions[key]
+                evicted.append(session)
+        self.evictions += len(evicted)
+        return evicted
+
+    @contextmanager
+    def session(self, url):
+        """
+        Borrow the session for the host of url
+
+        :param url: Url
+        :return: context manager that yields a requests.Session
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme.lower(), parts.netloc.lower())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                entry = [self._create_session(), now, 0]
+            else:
+                self.hits += 1
+            entry[1] = now
+            entry[2] += 1
+            self._sessions[key] = entry
+            evicted = self._evict(now)
+        for session in evicted:
+            session.close()
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] = time.monotonic()
+                entry[2] -= 1
+
+    def stats(self):
+        """
+        :return: dict with the number of pool hits, misses, evictions and open sessions
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'sessions': len(self._sessions),
+            }
+
+    def close(self):
+        """
+        Close all sessions
+        """
+        with self._lock:
+            sessions = [session for session, _, _ in self._sessions.values()]
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+session_pool = SessionPool()
+
+
+def download(url, max_content_length=1000, pool=None, cache=None, deadline=None,
+             min_partial_length=MIN_PARTIAL_LENGTH, prefix_callback=None):
     """
     Download content with an upper bound for the content_length
     :param url: Url
     :param max_content_length: length in bytes
+    :param pool: SessionPool, defaults to the process wide session_pool
+    :param cache: optional ResponseCache, used for conditional requests
+    :param deadline: optional Deadline for the whole download, a read that is still running
+                     when it passes is cut off. If it passes after at least min_partial_length
+                     bytes arrived, the partial content is returned.
+    :param min_partial_length: length in bytes
+    :param prefix_callback: optional function that is called with the decoded text of the
+                            first PREFIX_LENGTH bytes as soon as they arrived
     :return: DownloadedContent
     :raise DownloadException: for all errors
     """
-    try:
-        req = requests.get(url, stream=True, verify=False)
-    except requests.RequestException as e:
-        raise DownloadException("Request failed", parent=e)
+    if pool is None:
+        pool = session_pool
+    cached = cache.get(url) if cache is not None else None
+    headers = cached.conditional_headers() if cached is not None else {}
+    timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if deadline is not None:
+        if deadline.expired:
+            raise DownloadException('Deadline exceeded before the request', timed_out=True)
+        timeout = tuple(min(seconds, deadline.remaining()) for seconds in timeout)
+    with pool.session(url) as session:
+        try:
+            req = session.get(url, stream=True, verify=False, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            raise DownloadException("Request failed", parent=e)
+        watchdog = None
+        try:
+            if cached is not None and req.status_code == 304:
+                return DownloadedContent(content=cached.content, content_type=cached.content_type,
+                                         text=decode_text(cached.content, cached.content_type, cached.encoding),
+                                         encoding=cached.encoding)
+            if deadline is not None:
+                # a read only returns once its whole chunk arrived, a server that sends a few bytes
+                # at a time would hold it up far past the deadline
+                watchdog = threading.Timer(deadline.remaining(), _abort_read, (req,))
+                watchdog.daemon = True
+                watchdog.start()
+            dl = _read_response(req, max_content_length, deadline, min_partial_length, prefix_callback)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            # hands the connection back to the pool
+            req.close()
+    if cache is not None and not dl.partial:
+        cache.store(url, req, dl)
+    return dl
+
+
+def _abort_read(req):
+    """
+    End a read of a streamed response that is still waiting for data, called by another thread
+    """
+    sock = getattr(getattr(req.raw, '_connection', None), 'sock', None)
+    if sock is not None:
+        try:
+            # unlike close(), a shutdown wakes up a thread that is blocked in recv()
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def mime_type(content_type):
+    """
+    :param content_type: value of a content-type header
+    :return: lower case mime type without parameters
+    """
+    return content_type.split(';', 1)[0].strip().lower()
+
+
+def is_text(content_type):
+    """
+    :param content_type: mime type
+    :return: True if content of this type is decoded to text
+    """
+    mime = mime_type(content_type)
+    return mime.startswith('text/') or mime in TEXT_TYPES or mime.endswith(('+xml', '+json'))
+
+
+def _read_response(req, max_content_length, deadline=None, min_partial_length=MIN_PARTIAL_LENGTH,
+                   prefix_callback=None):
+    """
+    Read and decode the body of a streamed response chunk by chunk.
+    Of binary content only the beginning of PREFIX_TYPES is downloaded, the body of
+    other binary content is not downloaded at all.
+
+    :param req: requests.Response
+    :param max_content_length: length in bytes, longer content is cut off
+    :param deadline: optional Deadline
+    :param min_partial_length: length in bytes that is enough if the deadline passes
+    :param prefix_callback: optional function for the text of the first PREFIX_LENGTH bytes
+    :return: DownloadedContent
+    :raise DownloadException: if the server failed, the content is too long or too
+                              little content arrived before the deadline
+    """
+    if req.status_code >= 500:
+        raise DownloadException('Server error: status code {}'.format(req.status_code),
+                                status_code=req.status_code)
+
+    content_type = req.headers.get('content-type', '')
+    prefix_length = PREFIX_TYPES.get(mime_type(content_type))
 
     try:
         content_length = int(req.headers.get('content-length', 0))
@@ -30,36 +333,268 @@ def download(url, max_content_length=1000):
         # no valid content length set
         raise DownloadException("Could not convert: content-length = {}".format(
             req.headers.get('content-length')), parent=e)
-    else:
-        # if content is too long, abort.
-        if content_length > max_content_length:
-            raise DownloadException('Aborting: content-length {} is larger than max content length {}'.format(
-                content_length, max_content_length))
-        try:
+    # if content is too long, abort. Of prefix types only the beginning is read anyway.
+    if prefix_length is None and content_length > max_content_length:
+        raise DownloadException('Aborting: content-length {} is larger than max content length {}'.format(
+            content_length, max_content_length))
+
+    text = is_text(content_type)
+    if not text:
+        if prefix_length is None:
+            return DownloadedContent(content=None, text=None, content_type=content_type)
+        max_content_length = min(max_content_length, prefix_length)
+        prefix_callback = None
+
+    content = bytearray()
+    decoder = TextDecoder(req.encoding) if text else None
+    partial = False
+    try:
+        for chunk in req.iter_content(CHUNK_SIZE):
             # In case content_length lied to us
-            content = next(req.iter_content(max_content_length))
-        except StopIteration:
-            # And in case there is no content
-            content = None
+            chunk = chunk[:max_content_length - len(content)]
+            content.extend(chunk)
+            if decoder is not None:
+                decoder.feed(chunk)
+            if len(content) >= max_content_length:
+                break
+            if prefix_callback is not None and len(content) >= PREFIX_LENGTH:
+                prefix_callback(decoder.peek())
+                prefix_callback = None
+            if deadline is not None and deadline.expired:
+                break
+    except requests.RequestException as e:
+        # the server stopped sending, use what we got so far if it is enough
+        if len(content) < min_partial_length:
+            raise DownloadException('Reading the content failed', parent=e,
+                                    timed_out=deadline is not None and deadline.expired)
+        partial = True
+    else:
+        # cut off here or by the watchdog of download(), which looks like the end of the content
+        if deadline is not None and deadline.expired and len(content) < max_content_length:
+            if len(content) < min_partial_length:
+                raise DownloadException('Deadline exceeded after {} bytes'.format(len(content)),
+                                        timed_out=True)
+            partial = True
+    if not content:
+        # And in case there is no content
+        return DownloadedContent(content=None, text=None, content_type=content_type)
+    return DownloadedContent(content=bytes(content), text=decoder.finish() if text else None,
+                             content_type=content_type, partial=partial, encoding=req.encoding)
+
 
-        text = None
-        # only decode text requests
-        content_type = req.headers.get('content-type', '')
+class TextDecoder(object):
+    """
+    Incremental decoder for streamed text.
+
+    The first SNIFF_LENGTH bytes are buffered to look for a byte order mark or a charset
+    declared in the document, which takes precedence over the encoding from the headers.
+    Afterwards every chunk is decoded exactly once, invalid bytes are ignored.
+    """
 
-        if content_type.startswith('text/') and content is not None:
-            encoding = req.encoding
+    def __init__(self, header_encoding=None):
+        self.header_encoding = header_encoding
+        self.encoding = None
+        self._decoder = None
+        self._buffer = bytearray()
+        self._parts = []
+
+    def _candidates(self, head):
+        head = head[:SNIFF_LENGTH]
+        if head.startswith(codecs.BOM_UTF8):
+            yield 'utf-8-sig'
+        # the head is only searched for ascii meta tags, so a lossy decode is fine
+        for encoding in requests.utils.get_encodings_from_content(head.decode('ascii', errors='ignore')):
+            yield encoding
+        if self.header_encoding:
+            yield self.header_encoding
+        yield 'utf-8'
+
+    def _start(self):
+        head = bytes(self._buffer)
+        for encoding in self._candidates(head):
+            try:
+                self._decoder = codecs.getincrementaldecoder(encoding)(errors='ignore')
+            except (LookupError, TypeError):
+                continue
+            self.encoding = encoding
+            break
+        self._buffer = None
+        self._parts.append(self._decoder.decode(head))
+
+    def feed(self, chunk):
+        """
+        :param chunk: byte string
+        """
+        if self._decoder is None:
+            self._buffer.extend(chunk)
+            if len(self._buffer) >= SNIFF_LENGTH:
+                self._start()
+        else:
+            self._parts.append(self._decoder.decode(chunk))
+
+    def peek(self):
+        """
+        :return: the text decoded so far, None before SNIFF_LENGTH bytes were fed
+        """
+        if self._decoder is None:
+            return None
+        return ''.join(self._parts)
+
+    def finish(self):
+        """
+        :return: the decoded text
+        """
+        if self._decoder is None:
+            self._start()
+        self._parts.append(self._decoder.decode(b'', final=True))
+        return ''.join(self._parts)
+
+
+def decode_text(content, content_type, encoding):
+    """
+    Decode text content
+
+    :param content: byte string or None
+    :param content_type: mime type
+    :param encoding: encoding from the response headers
+    :return: unicode text or None if the content is not text
+    """
+    if not is_text(content_type) or content is None:
+        return None
+    decoder = TextDecoder(encoding)
+    decoder.feed(content)
+    return decoder.finish()
+
+
+class CachedResponse(namedtuple('CachedResponse', ('etag', 'last_modified', 'content_type', 'encoding', 'content'))):
+
+    def conditional_headers(self):
+        """
+        :return: headers for a request that is answered with 304 if the content did not change
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of the compressed raw content and validators (ETag, Last-Modified) of
+    downloaded urls. Only responses with validators are stored, files can be deleted at any time.
+    If there are more than max_entries entries, the least recently used ones are deleted.
+    """
+
+    def __init__(self, directory, max_entries=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # counted on the first store, other processes sharing the directory are noticed when pruning
+        self._entries = None
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan(self):
+        """
+        :return: (modification time, path) of every entry
+        """
+        entries = []
+        try:
+            subdirectories = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for subdirectory in subdirectories:
+            subdirectory = os.path.join(self.directory, subdirectory)
             try:
-                text = content.decode(encoding, errors='ignore')
-            except LookupError:
-                pass
+                names = os.listdir(subdirectory)
+            except OSError:
+                continue
+            # skips the temporary files of unfinished stores
+            for name in (name for name in names if len(name) == 40):
+                path = os.path.join(subdirectory, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    # deleted in the meantime
+                    pass
+        return entries
+
+    def _entry_added(self):
+        if self.max_entries is None:
+            return
+        with self._lock:
+            if self._entries is None:
+                self._entries = len(self._scan())
             else:
-                content_encodings = requests.utils.get_encodings_from_content(text)
-                # if we detect more than the fallback encoding, use that one
-                if content_encodings != ['ISO-8859-1']:
-                    try:
-                        text = content.decode(content_encodings[0], errors='ignore')
-                    except LookupError:
-                        pass
+                self._entries += 1
+            if self._entries <= self.max_entries:
+                return
+            entries = sorted(self._scan())
+            # a tenth more than necessary, so not every store has to scan the directory
+            evicted = entries[:max(0, len(entries) - self.max_entries * 9 // 10)]
+            for _, path in evicted:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._entries = len(entries) - len(evicted)
 
-        return DownloadedContent(content=content, text=text, content_type=content_type)
+    def get(self, url):
+        """
+        :param url: Url
+        :return: CachedResponse or None
+        """
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                header, _, body = f.read().partition(b'\n')
+            meta = json.loads(header.decode('utf-8'))
+            content = zlib.decompress(body) if meta['has_content'] else None
+            # the modification time tells the least recently used entries
+            os.utime(path)
+        except (OSError, ValueError, KeyError, zlib.error):
+            return None
+        return CachedResponse(etag=meta['etag'], last_modified=meta['last_modified'],
+                              content_type=meta['content_type'], encoding=meta['encoding'],
+                              content=content)
+
+    def store(self, url, req, dl):
+        """
+        Remember the content of a response if it has validators
 
+        :param url: Url
+        :param req: requests.Response
+        :param dl: DownloadedContent read from req
+        """
+        etag = req.headers.get('etag')
+        last_modified = req.headers.get('last-modified')
+        if req.status_code != 200 or not (etag or last_modified):
+            return
+        meta = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content_type': dl.content_type,
+            'encoding': req.encoding,
+            'has_content': dl.content is not None,
+        }
+        body = zlib.compress(dl.content) if dl.content is not None else b''
+        path = self._path(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first, readers never see half written entries
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8'))
+                f.write(b'\n')
+                f.write(body)
+            added = not os.path.exists(path)
+            os.replace(tmp_path, path)
+        except OSError:
+            # the cache is only an optimization
+            return
+        if added:
+            self._entry_added()
@@ -0,0 +1,199 @@
+"""
+Search index updates in the background.
+
+Instead of writing to the search index while a request is handled, the signal processor
+:class:`readme.signals.QueuedSignalProcessor` only records the ids of changed items as
+:class:`readme.models.IndexUpdate`. Several changes of the same item are merged into one
+record. ``manage.py run_indexer`` indexes the recorded items in batches, each batch with a
+single commit to the index.
+
+``manage.py reindex_items`` indexes all items or the recently modified ones again, split by
+id ranges across several processes.
+"""
+from multiprocessing import Pool
+import logging
+import threading
+
+from django.db import connection, connections as db_connections, transaction, IntegrityError
+from django.db.models import F, Min, Max
+from django.utils import timezone
+from haystack import connections, connection_router
+from haystack.exceptions import NotHandled
+
+from readme.models import Item, IndexUpdate
+
+index_log = logging.getLogger('readme.indexing')
+
+
+def queue_index_update(item_id):
+    """
+    Record that the search index entry of an item is out of date
+
+    :param item_id: id of a changed or deleted item
+    """
+    now = timezone.now()
+    # a later change of the item bumps the version, so it is not dropped by a running batch
+    changed = IndexUpdate.objects.filter(item_id=item_id)
+    if not changed.update(queued=now, version=F('version') + 1):
+        try:
+            with transaction.atomic():
+                IndexUpdate.objects.create(item_id=item_id, queued=now)
+        except IntegrityError:
+            changed.update(queued=now, version=F('version') + 1)
+
+
+def process_index_queue(batch_size=500):
+    """
+    Update the index entries of the oldest recorded items, remove the entries of deleted ones
+
+    :param batch_size: number of items indexed at once
+    :return: number of processed records
+    """
+    versions = dict(IndexUpdate.objects.order_by('queued').values_list('item_id', 'version')[:batch_size])
+    if not versions:
+        return 0
+    items = list(Item.objects.filter(pk__in=versions).with_tag_names())
+    deleted = set(versions) - {item.pk for item in items}
+    for using in connection_router.for_write():
+        try:
+            index = connections[using].get_unified_index().get_index(Item)
+        except NotHandled:
+            continue
+        backend = connections[using].get_backend()
+        if items:
+            _update_items(backend, index, items)
+        for item_id in deleted:
+            backend.remove('{}.{}.{}'.format(Item._meta.app_label, Item._meta.model_name, item_id))
+    # items that changed again while the batch was indexed stay queued
+    by_version = {}
+    for item_id, version in versions.items():
+        by_version.setdefault(version, []).append(item_id)
+    for version, item_ids in by_version.items():
+        IndexUpdate.objects.filter(item_id__in=item_ids, version=version).delete()
+    return len(versions)
+
+
+def _update_items(backend, index, items):
+    try:
+        backend.update(index, items)
+    except Exception:
+        # find the items that break the batch, the others are indexed anyway
+        for item in items:
+            try:
+                backend.update(index, [item])
+            except Exception:
+                # dropped from the queue, the next change of the item or reindex_items tries again
+                index_log.exception('Could not index item %s', item.pk)
+
+
+def flush_index_queue(batch_size=500):
+    """
+    Index all recorded items right away
+
+    :return: number of processed records
+    """
+    processed = 0
+    while True:
+        count = process_index_queue(batch_size)
+        if not count:
+            return processed
+        processed += count
+
+
+def index_id_range(start_id, end_id, since=None, batch_size=1000):
+    """
+    Index the items with start_id <= id < end_id in batches
+
+    :param since: only index items modified after this datetime
+    :param batch_size: number of items indexed at once
+    :return: number of indexed items
+    """
+    items = Item.objects.filter(id__gte=start_id, id__lt=end_id)
+    if since is not None:
+        items = items.filter(modified__gte=since)
+    indexed = 0
+    last_id = start_id - 1
+    while True:
+        batch = list(items.filter(id__gt=last_id).order_by('id').with_tag_names()[:batch_size])
+        if not batch:
+            return indexed
+        last_id = batch[-1].id
+        for using in connection_router.for_write():
+            try:
+                index = connections[using].get_unified_index().get_index(Item)
+            except NotHandled:
+                continue
+            connections[using].get_backend().update(index, batch)
+        indexed += len(batch)
+
+
+def _index_shard(args):
+    indexed = index_id_range(*args)
+    # Whoosh commits in a thread if another process holds the lock of the index,
+    # the process must not exit before that thread is done
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join()
+    return indexed
+
+
+def reindex(processes=1, since=None, batch_size=1000, optimize=False):
+    """
+    Index all items or the ones modified since a date again. The id range of the items is
+    split into shards that are indexed by a pool of processes.
+
+    :param processes: number of processes, 1 indexes in the current process
+    :param since: only index items modified after this datetime
+    :param batch_size: number of items indexed at once
+    :param optimize: merge the segments of the index afterwards
+    :return: number of indexed items
+    """
+    items = Item.objects.all()
+    if since is not None:
+        items = items.filter(modified__gte=since)
+    bounds = items.aggregate(first=Min('id'), last=Max('id'))
+    indexed = 0
+    if bounds['first'] is not None:
+        # more shards than processes, so a process that got a dense range does not hold up the others
+        shard_count = processes * 4 if processes > 1 else 1
+        shard_size = (bounds['last'] - bounds['first']) // shard_count + 1
+        shards = [(start, start + shard_size, since, batch_size)
+                  for start in range(bounds['first'], bounds['last'] + 1, shard_size)]
+        if processes > 1:
+            # the processes must not share the database connections of this one
+            for db_connection in db_connections.all():
+                db_connection.close()
+            pool = Pool(processes)
+            try:
+                indexed = sum(pool.imap_unordered(_index_shard, shards))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            indexed = sum(index_id_range(*shard) for shard in shards)
+    if optimize:
+        for using in connection_router.for_write():
+            connections[using].get_backend().optimize()
+    return indexed
+
+
+def run_indexer(stop_event, interval=5.0, batch_size=500):
+    """
+    Process the queue until stop_event is set. Waits interval seconds whenever the queue is
+    empty, so the index is at most that many seconds behind while the indexer keeps up.
+
+    :param stop_event: threading.Event
+    :param interval: seconds
+    :param batch_size: number of items indexed at once
+    """
+    try:
+        while not stop_event.is_set():
+            try:
+                processed = process_index_queue(batch_size)
+            except Exception:
+                index_log.exception('Indexer failed to process a batch')
+                processed = 0
+            if not processed:
+                stop_event.wait(interval)
+    finally:
+        connection.close()
@@ -0,0 +1,151 @@
+"""
+Database backed queue for article downloads.
+
+New items are saved right away in the ``pending`` state and a :class:`readme.models.FetchJob`
+is queued for them. The workers started with ``manage.py run_fetch_workers`` claim those
+jobs, download and parse the article and fill in the item.
+"""
+from datetime import timedelta
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from readme.download import DownloadDeferred
+from readme.models import Item, FetchJob
+
+job_log = logging.getLogger('readme.jobs')
+
+
+def schedule_fetch(item):
+    """
+    Fetch the article of a saved item, either by a background worker or right away
+    if PYPO_FETCH_IN_BACKGROUND is disabled.
+
+    :param item: saved Item
+    """
+    if not settings.PYPO_FETCH_IN_BACKGROUND:
+        try:
+            item.fetch_article()
+        except DownloadDeferred as e:
+            # leave it to the background workers
+            job_log.info('Deferring %s: %s', item.url, e.message)
+            defer_job(_queue_job(item), e.retry_after)
+        else:
+            item.save()
+        return
+    _queue_job(item)
+
+
+def _queue_job(item):
+    if item.status != Item.PENDING:
+        Item.objects.filter(pk=item.pk).update(status=Item.PENDING)
+        item.status = Item.PENDING
+    job, _ = FetchJob.objects.get_or_create(item=item)
+    return job
+
+
+def defer_job(job, seconds, claimed=False):
+    """
+    Let a job wait before a worker claims it again
+
+    :param job: FetchJob
+    :param seconds: delay
+    :param claimed: True if a worker claimed the job, that attempt is not counted
+    """
+    # claim_job takes jobs that were started more than PYPO_FETCH_JOB_TIMEOUT seconds ago
+    started = timezone.now() + timedelta(seconds=seconds - settings.PYPO_FETCH_JOB_TIMEOUT)
+    updates = {'started': started}
+    if claimed:
+        updates['attempts'] = F('attempts') - 1
+    FetchJob.objects.filter(id=job.id).update(**updates)
+
+
+def claim_job():
+    """
+    Claim the oldest waiting job. Jobs that were started but not finished within
+    PYPO_FETCH_JOB_TIMEOUT seconds are considered abandoned and can be claimed again.
+
+    :return: FetchJob or None if there is nothing to do
+    """
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=settings.PYPO_FETCH_JOB_TIMEOUT)
+    candidates = FetchJob.objects.filter(
+        Q(started__isnull=True) | Q(started__lt=abandoned)).order_by('created').values_list('id', 'started')
+    for job_id, started in candidates[:10]:
+        # the update only matches if no other worker claimed the job in the meantime
+        claimed = FetchJob.objects.filter(id=job_id, started=started).update(
+            started=now, attempts=F('attempts') + 1)
+        if claimed:
+            return FetchJob.objects.select_related('item').get(id=job_id)
+    return None
+
+
+def process_job(job):
+    """
+    Fetch the article of the job's item and remove the job afterwards.
+    Failing jobs are retried until PYPO_FETCH_JOB_MAX_ATTEMPTS is reached.
+
+    :param job: claimed FetchJob
+    """
+    item = job.item
+    shown_titles = []
+
+    def show_title(title):
+        # the list shows the title while the rest of the page is downloaded and parsed
+        if Item.objects.filter(pk=item.pk, status=Item.PENDING, title=item.title).update(title=title):
+            shown_titles.append(title)
+
+    try:
+        item.fetch_article(on_title=show_title, raise_errors=True)
+        # only write the fetched fields, the user might have changed tags or the title meanwhile
+        item.save_fetched(shown_titles)
+    except DownloadDeferred as e:
+        job_log.info('Deferring %s: %s', item.url, e.message)
+        defer_job(job, e.retry_after, claimed=True)
+        return
+    except Exception:
+        job_log.exception('Fetching %s failed', item.url)
+        if job.attempts < settings.PYPO_FETCH_JOB_MAX_ATTEMPTS:
+            FetchJob.objects.filter(id=job.id).update(started=None)
+            return
+        item.read_article(None)
+        item.save_fetched(shown_titles)
+    job.delete()
+
+
+def process_next_job():
+    """
+    Claim and process a single job
+
+    :return: True if a job was processed
+    """
+    job = claim_job()
+    if job is None:
+        return False
+    process_job(job)
+    return True
+
+
+def run_worker(stop_event, poll_interval=1.0):
+    """
+    Process jobs until stop_event is set. Sleeps for poll_interval seconds whenever
+    the queue is empty.
+
+    :param stop_event: threading.Event
+    :param poll_interval: seconds
+    """
+    try:
+        while not stop_event.is_set():
+            try:
+                found = process_next_job()
+            except Exception:
+                job_log.exception('Fetch worker failed to process a job')
+                found = False
+            if not found:
+                stop_event.wait(poll_interval)
+    finally:
+        # every thread has its own connection
+        connection.close()
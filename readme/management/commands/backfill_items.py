@@ -0,0 +1,65 @@
+from collections import defaultdict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from readme.download import hash_url
+from readme.models import Item, get_domain, make_excerpt
+
+
+class Command(BaseCommand):
+    help = 'Fills in the computed columns of items that were saved before the columns existed'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-b', '--batch-size', type='int', default=1000,
+                    help='Number of items updated at once (default: 1000)'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        filled = 0
+        last_id = 0
+        while True:
+            batch = list(Item.objects.filter(Q(domain__isnull=True) | Q(url_hash__isnull=True), id__gt=last_id)
+                         .order_by('id').values_list('id', 'url')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            with transaction.atomic():
+                # one update per domain instead of one per item
+                ids_by_domain = defaultdict(list)
+                for item_id, url in batch:
+                    ids_by_domain[get_domain(url)].append(item_id)
+                for domain, ids in ids_by_domain.items():
+                    Item.objects.filter(id__in=ids).update(domain=domain)
+                # the hashes differ for every url
+                for item_id, url in batch:
+                    Item.objects.filter(id=item_id).update(url_hash=hash_url(url))
+            filled += len(batch)
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Filled in {} items'.format(filled))
+        self.stdout.write('Filled in the domain and url hash of {} items, run manage.py update_index to '
+                          'add them to the search index'.format(filled))
+        self.stdout.write('Filled in the excerpt of {} items'.format(self.fill_excerpts(batch_size)))
+
+    def fill_excerpts(self, batch_size):
+        filled = 0
+        last_id = 0
+        while True:
+            # only the articles of one batch are in memory at once
+            batch = list(Item.objects.filter(excerpt__isnull=True, id__gt=last_id).order_by('id')
+                         .values_list('id', 'readable_article', 'safe_article', 'document__safe_article')
+                         [:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            with transaction.atomic():
+                for item_id, readable_article, safe_article, document_article in batch:
+                    # the same choice as Item.safe_text
+                    if not readable_article and document_article is not None:
+                        safe_article = document_article
+                    Item.objects.filter(id=item_id).update(excerpt=make_excerpt(safe_article))
+            filled += len(batch)
+        return filled
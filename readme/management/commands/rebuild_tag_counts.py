@@ -0,0 +1,25 @@
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from readme.models import UserTagCount
+
+
+class Command(BaseCommand):
+    help = 'Counts the tags of all items again, in case the stored counts are wrong'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-u', '--user', dest='username',
+                    help='Only recount the tags of this user'),
+    )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['username']:
+            try:
+                user = User.objects.get(username=options['username'])
+            except User.DoesNotExist:
+                raise CommandError('User {} does not exist'.format(options['username']))
+        counted = UserTagCount.objects.rebuild(user)
+        self.stdout.write('Counted {} tags'.format(counted))
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+from optparse import make_option
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from readme.models import Document, Item
+from readme.scrapers import ParserPool, ParserException, PARSER_VERSION
+
+PARSE_FAILED = object()
+
+
+class Command(BaseCommand):
+    help = 'Parses the stored snapshots of pages again that were parsed by older parsers'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-p', '--processes', type='int', default=multiprocessing.cpu_count(),
+                    help='Number of parser processes (default: number of cpus)'),
+        make_option('-b', '--batch-size', type='int', default=100,
+                    help='Number of documents loaded at once (default: 100)'),
+    )
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        pool = ParserPool(processes=processes, cpu_timeout=settings.PYPO_PARSER_TIMEOUT,
+                          memory_limit=settings.PYPO_PARSER_MEMORY_LIMIT,
+                          max_tasks=settings.PYPO_PARSER_MAX_TASKS)
+        stale = Document.objects.filter(parser_version__lt=PARSER_VERSION, snapshot__isnull=False)
+        document_ids = list(stale.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        updated = failed = 0
+        try:
+            # the threads only wait for the parser processes, the database is used by this thread
+            with ThreadPoolExecutor(max_workers=processes) as executor:
+                for start in range(0, len(document_ids), batch_size):
+                    documents = list(Document.objects.filter(id__in=document_ids[start:start + batch_size]))
+                    parsed = executor.map(lambda document: _parse_snapshot(document, pool), documents)
+                    for document, result in zip(documents, parsed):
+                        if result is PARSE_FAILED:
+                            # keeps the old article and parser_version, a later run tries again
+                            failed += 1
+                        elif result is not None:
+                            document.update_article(*result)
+                            updated += 1
+        finally:
+            pool.close()
+
+        missing = Item.objects.filter(parser_version__lt=PARSER_VERSION, status=Item.FETCHED).count()
+        self.stdout.write('Parsed {} documents again, {} failed, {} items have no snapshot and need to be '
+                          'fetched again'.format(updated, failed, missing))
+
+
+def _parse_snapshot(document, pool):
+    try:
+        return document.parse_snapshot(pool)
+    except ParserException:
+        return PARSE_FAILED
@@ -0,0 +1,53 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from readme.bulk import fetch_many
+from readme.download import DownloadDeferred
+from readme.models import Item, domain_scheduler, response_cache
+
+
+class Command(BaseCommand):
+    help = 'Downloads and parses the articles of many items in parallel'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', type='int', default=16,
+                    help='Number of parallel downloads (default: 16)'),
+        make_option('--per-host', type='int', default=2,
+                    help='Number of parallel downloads per host (default: 2)'),
+        make_option('-u', '--user', dest='username',
+                    help='Only refetch the items of this user'),
+        make_option('--status', choices=[status for status, _ in Item.STATUS_CHOICES],
+                    help='Only refetch items with this status, e.g. failed'),
+    )
+
+    def handle(self, *args, **options):
+        # the old articles are replaced anyway, loading them for every item would fill the memory
+        items = Item.objects.for_list()
+        if options['username']:
+            items = items.filter(owner__username=options['username'])
+        if options['status']:
+            items = items.filter(status=options['status'])
+
+        fetched = failed = deferred = 0
+        results = fetch_many(items.iterator(), workers=options['workers'], per_host=options['per_host'],
+                             max_content_length=settings.PYPO_MAX_CONTENT_LENGTH,
+                             scheduler=domain_scheduler, cache=response_cache,
+                             timeout=settings.PYPO_FETCH_DEADLINE,
+                             min_partial_length=settings.PYPO_FETCH_MIN_PARTIAL_LENGTH)
+        for result in results:
+            item = result.item
+            if isinstance(result.error, DownloadDeferred):
+                # the domain is busy or failing, the item keeps its article
+                deferred += 1
+                continue
+            item.read_article(result.content)
+            item.save_fetched()
+            if result.error is None:
+                fetched += 1
+            else:
+                failed += 1
+                if int(options['verbosity']) > 1:
+                    self.stdout.write('{}: {}'.format(item.url, result.error.message))
+        self.stdout.write('Fetched {} items, {} failed, {} deferred'.format(fetched, failed, deferred))
@@ -0,0 +1,31 @@
+from datetime import timedelta
+from multiprocessing import cpu_count
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from readme.indexing import reindex
+
+
+class Command(BaseCommand):
+    help = 'Indexes all items or the recently modified ones in parallel'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-a', '--age', type='float',
+                    help='Only index items modified in the last AGE hours'),
+        make_option('-p', '--processes', type='int', default=cpu_count(),
+                    help='Number of indexing processes (default: number of cpus)'),
+        make_option('-b', '--batch-size', type='int', default=1000,
+                    help='Number of items indexed at once (default: 1000)'),
+        make_option('--optimize', action='store_true', default=False,
+                    help='Merge the segments of the index afterwards, always done without --age'),
+    )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['age'] is not None:
+            since = timezone.now() - timedelta(hours=options['age'])
+        indexed = reindex(processes=options['processes'], since=since, batch_size=options['batch_size'],
+                          optimize=options['optimize'] or since is None)
+        self.stdout.write('Indexed {} items'.format(indexed))
@@ -0,0 +1,38 @@
+from optparse import make_option
+import threading
+
+from django.core.management.base import BaseCommand
+
+from readme.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Runs a pool of workers that download the articles of new items'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-w', '--workers', type='int', default=4,
+                    help='Number of worker threads (default: 4)'),
+        make_option('-p', '--poll-interval', type='float', default=1.0,
+                    help='Seconds to wait when the queue is empty (default: 1)'),
+    )
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+        workers = [
+            threading.Thread(target=run_worker, args=(stop_event, options['poll_interval']),
+                             name='fetch-worker-{}'.format(i))
+            for i in range(options['workers'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write('Started {} fetch workers'.format(len(workers)))
+        try:
+            while any(worker.is_alive() for worker in workers):
+                for worker in workers:
+                    worker.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping fetch workers')
+        finally:
+            stop_event.set()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,38 @@
+from optparse import make_option
+import threading
+
+from django.core.management.base import BaseCommand
+
+from readme.indexing import run_indexer, flush_index_queue
+
+
+class Command(BaseCommand):
+    help = 'Updates the search index entries of changed items in batches'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-i', '--interval', type='float', default=5.0,
+                    help='Seconds to wait when no item changed (default: 5)'),
+        make_option('-b', '--batch-size', type='int', default=500,
+                    help='Number of items indexed at once (default: 500)'),
+        make_option('--once', action='store_true', default=False,
+                    help='Index all changed items and exit'),
+    )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = flush_index_queue(options['batch_size'])
+            self.stdout.write('Indexed {} items'.format(processed))
+            return
+        stop_event = threading.Event()
+        indexer = threading.Thread(target=run_indexer, args=(stop_event, options['interval'], options['batch_size']),
+                                   name='indexer')
+        indexer.start()
+        self.stdout.write('Started the indexer')
+        try:
+            while indexer.is_alive():
+                indexer.join(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping the indexer')
+        finally:
+            stop_event.set()
+            indexer.join()
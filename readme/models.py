@@ -1,35 +1,105 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.conf import settings
-from django.db.models.signals import post_save
-from django.dispatch import receiver
-from django.utils.functional import cached_property
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver, Signal
+from django.utils import timezone
+from django.utils.text import Truncator
 from tld import get_tld
 from django.core.urlresolvers import reverse
 from taggit.managers import TaggableManager
 from taggit.models import TagBase, ItemBase
-from readme.download import download, DownloadException
-from readme.scrapers import parse
+from contextlib import contextmanager
+from datetime import timedelta
+from readme.download import Deadline, DownloadException, DownloadDeferred, DownloadedContent, ResponseCache, decode_text, \
+    normalize_url, hash_url
+from readme.scheduler import DomainScheduler
+from readme.scrapers import parse, extract_title, ParserPool, PARSER_VERSION
 
 import logging
+import threading
+import zlib
 import bleach
 
 request_log = logging.getLogger('readme.requests')
 
+#: Number of characters of the article that are shown in the item lists
+EXCERPT_LENGTH = 250
+
+#: Sent with the item after its tags were changed inside changing_tags()
+tags_changed = Signal(providing_args=['instance'])
+
+domain_scheduler = DomainScheduler(
+    rate=settings.PYPO_DOMAIN_RATE,
+    burst=settings.PYPO_DOMAIN_BURST,
+    failure_threshold=settings.PYPO_DOMAIN_FAILURE_THRESHOLD,
+    reset_timeout=settings.PYPO_DOMAIN_RETRY_AFTER,
+    negative_ttl=settings.PYPO_FAILED_URL_TTL)
+
+response_cache = ResponseCache(settings.PYPO_RESPONSE_CACHE_DIR, max_entries=settings.PYPO_RESPONSE_CACHE_MAX_ENTRIES) \
+    if settings.PYPO_RESPONSE_CACHE_DIR else None
+parser_pool = ParserPool(processes=settings.PYPO_PARSER_PROCESSES, cpu_timeout=settings.PYPO_PARSER_TIMEOUT,
+                         memory_limit=settings.PYPO_PARSER_MEMORY_LIMIT,
+                         max_tasks=settings.PYPO_PARSER_MAX_TASKS) if settings.PYPO_PARSER_PROCESSES else None
+
 
 class ItemQuerySet(models.query.QuerySet):
 
     def tagged(self, *tags):
-        filtered = self
-        for tag in tags:
-            filtered = filtered.filter(tags__name=tag)
-        return filtered
+        """
+        Items that have all of the tags, with a single subquery no matter how many tags
+        """
+        tags = set(tags)
+        if not tags:
+            return self
+        tag_ids = list(ItemTag.objects.filter(name__in=tags).values_list('id', flat=True))
+        if len(tag_ids) < len(tags):
+            # one of the tags does not exist at all
+            return self.none()
+        matching = TaggedItem.objects.filter(tag_id__in=tag_ids).values('content_object') \
+            .annotate(matches=models.Count('tag')).filter(matches=len(tag_ids)).values('content_object')
+        return self.filter(id__in=matching)
 
     def without(self, *tags):
-        filtered = self
-        for tag in tags:
-            filtered = filtered.exclude(tags__name=tag)
-        return filtered
+        """
+        Items that have none of the tags, with a single subquery no matter how many tags
+        """
+        if not tags:
+            return self
+        return self.exclude(id__in=TaggedItem.objects.filter(tag__name__in=tags).values('content_object'))
+
+    def tag_counts(self):
+        """
+        :return: list of (tag name, number of items with the tag) for the items of this queryset,
+                 the most used tags first
+        """
+        return list(TaggedItem.objects.filter(content_object__in=self.values('id'))
+                    .values_list('tag__name').annotate(count=models.Count('id')).order_by('-count', 'tag__name'))
+
+    def saved_url(self, owner, url):
+        """
+        :return: the Item of the owner with the same normalized url or None
+        """
+        return self.filter(owner=owner, url_hash=hash_url(url)).first()
+
+    def with_tag_names(self):
+        """
+        Load the tags of all items with one additional query, Item.tag_names uses them
+        """
+        return self.prefetch_related('tags')
+
+    def for_list(self, with_article=False):
+        """
+        Items for the lists, which show the excerpt instead of the article. The article columns
+        are only loaded when they are accessed.
+
+        :param with_article: load readable_article anyway, together with the article of the
+                             shared document that Item.article falls back to
+        """
+        if with_article:
+            return self.select_related('document').defer(
+                'safe_article', 'document__safe_article', 'document__snapshot')
+        return self.defer('readable_article', 'safe_article')
 
 
 class ItemManager(models.Manager):
@@ -42,6 +112,156 @@ class ItemManager(models.Manager):
             raise AttributeError
         return getattr(self.get_query_set(), name, *args)
 
+def get_domain(url):
+    """
+    Registered domain of an url, like example.co.uk for http://www.example.co.uk/
+
+    :param url: Url
+    :return: domain or an empty string if the url has no known top level domain
+    """
+    return get_tld(url, fail_silently=True) or ''
+
+
+def bleach_article(article):
+    """
+    Escape an article and strip it of all tags
+
+    :param article: html
+    :return: safe text
+    """
+    if article:
+        return bleach.clean(article, strip=True, tags=[])
+    else:
+        return ''
+
+
+def make_excerpt(safe_text):
+    """
+    Beginning of an escaped article that is shown in the item lists
+
+    :param safe_text: escaped article
+    :return: at most EXCERPT_LENGTH characters
+    """
+    return Truncator(safe_text).chars(EXCERPT_LENGTH)
+
+
+class DocumentManager(models.Manager):
+
+    def fresh(self, url):
+        """
+        Document for the url if it was fetched within the last PYPO_DOCUMENT_MAX_AGE seconds
+
+        :param url: Url
+        :return: Document or None
+        """
+        fetched_after = timezone.now() - timedelta(seconds=settings.PYPO_DOCUMENT_MAX_AGE)
+        return self.filter(url_hash=hash_url(url), fetched__gte=fetched_after).first()
+
+    def store(self, url, title, readable_article, dl=None):
+        """
+        Create or update the document for an url
+
+        :param url: Url
+        :param title: Page title
+        :param readable_article: Processed content of the url
+        :param dl: DownloadedContent the article was parsed from, stored as snapshot
+                   if PYPO_STORE_SNAPSHOTS is enabled
+        :return: Document
+        """
+        defaults = {
+            'url': normalize_url(url),
+            'title': title,
+            'readable_article': readable_article,
+            'safe_article': bleach_article(readable_article),
+            'fetched': timezone.now(),
+            'parser_version': PARSER_VERSION,
+            'snapshot': None,
+            'content_type': '',
+            'encoding': '',
+        }
+        if dl is not None and dl.content and settings.PYPO_STORE_SNAPSHOTS:
+            defaults.update(snapshot=zlib.compress(dl.content), content_type=dl.content_type,
+                            encoding=dl.encoding or '')
+        document, _ = self.update_or_create(url_hash=hash_url(url), defaults=defaults)
+        return document
+
+
+class Document(models.Model):
+    """
+    Fetched content of an url, shared by the items of all users that saved it
+    """
+    #:param url Normalized page url
+    url = models.URLField(max_length=2000)
+    #:param url_hash Hash of the normalized url
+    url_hash = models.CharField(max_length=40, unique=True)
+    #:param title Page title
+    title = models.TextField(blank=True)
+    #:param readable_article Processed content of the url
+    readable_article = models.TextField(blank=True)
+    #:param safe_article Escaped and stripped of tags
+    safe_article = models.TextField(blank=True)
+    #:param fetched Date of the last download
+    fetched = models.DateTimeField()
+    #:param snapshot Compressed raw content of the page
+    snapshot = models.BinaryField(null=True)
+    #:param content_type Content type of the snapshot
+    content_type = models.CharField(max_length=255, blank=True)
+    #:param encoding Encoding of the snapshot from the response headers
+    encoding = models.CharField(max_length=64, blank=True)
+    #:param parser_version Version of the parsers that extracted title and readable_article
+    parser_version = models.PositiveIntegerField(default=0)
+
+    objects = DocumentManager()
+
+    def read_snapshot(self):
+        """
+        :return: DownloadedContent of the snapshot or None if there is none
+        """
+        if not self.snapshot:
+            return None
+        content = zlib.decompress(self.snapshot)
+        encoding = self.encoding or None
+        return DownloadedContent(text=decode_text(content, self.content_type, encoding), content=content,
+                                 content_type=self.content_type, encoding=encoding)
+
+    def parse_snapshot(self, pool=None):
+        """
+        Parse the snapshot with the current parsers, without touching the database
+
+        :param pool: optional ParserPool
+        :return: title, readable_article or None if there is no snapshot
+        :raise ParserException: if the snapshot could not be parsed
+        """
+        dl = self.read_snapshot()
+        if dl is None:
+            return None
+        return parse(Item(url=self.url), content_type=dl.content_type, text=dl.text, content=dl.content,
+                     pool=pool, raise_errors=True)
+
+    def update_article(self, title, readable_article):
+        """
+        Save a newly extracted title and article and show them in all items of the document.
+        Items whose title was changed by their owner keep it.
+
+        :param title: Page title
+        :param readable_article: Processed content of the url
+        """
+        old_title = self.title
+        self.title = title
+        self.readable_article = readable_article
+        self.safe_article = bleach_article(readable_article)
+        self.parser_version = PARSER_VERSION
+        self.save(update_fields=['title', 'readable_article', 'safe_article', 'parser_version'])
+        for item in self.items.all():
+            if item.title == old_title:
+                item.title = title
+            item.parser_version = PARSER_VERSION
+            if not item.readable_article:
+                item.excerpt = make_excerpt(self.safe_article)
+            # saving updates the search index as well
+            item.save(update_fields=['title', 'parser_version', 'excerpt'])
+
+
 class ItemTag(TagBase):
 
     def slugify(self, tag, i=None):
@@ -67,12 +287,23 @@ class Item(models.Model):
     Entry in the read-it-later-list
 
     """
+    PENDING = 'pending'
+    FETCHED = 'fetched'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (FETCHED, 'Fetched'),
+        (FAILED, 'Failed'),
+    )
+
     #:param url Page url
     url = models.URLField(max_length=2000)
     #:param title Page title
     title = models.TextField(blank=True)
     #:param created Creating date of the item
     created = models.DateTimeField(auto_now_add=True)
+    #:param modified Date of the last change of the item or its tags
+    modified = models.DateTimeField(auto_now=True, db_index=True)
     #:param owner Owning user
     owner = models.ForeignKey(User)
     #:param readable_article Processed content of the url
@@ -81,21 +312,66 @@ class Item(models.Model):
     safe_article = models.TextField(blank=True)
     #:param tags User assigned tags
     tags = TaggableManager(blank=True, through=TaggedItem)
+    #:param status State of the article download
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=FETCHED)
+    #:param document Shared content of the url, used unless the item has its own readable_article
+    document = models.ForeignKey(Document, null=True, blank=True, on_delete=models.SET_NULL,
+                                 related_name='items')
+    #:param parser_version Version of the parsers that extracted the title and article
+    parser_version = models.PositiveIntegerField(default=0)
+    #:param domain Registered domain of the url, computed on save
+    domain = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    #:param url_hash hash_url() of the url, computed on save, indexed together with the owner
+    url_hash = models.CharField(max_length=40, null=True, blank=True)
+    #:param excerpt Beginning of the escaped article shown in the lists, computed on save
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, null=True, blank=True)
 
     objects = ItemManager()
+
+    class Meta:
+        index_together = [('owner', 'created'), ('owner', 'url_hash')]
+
+    #: Fields that are written by fetch_article, except for the title, see save_fetched()
+    FETCHED_FIELDS = ['readable_article', 'safe_article', 'excerpt', 'status', 'document', 'parser_version']
+
+    def __init__(self, *args, **kwargs):
+        super(Item, self).__init__(*args, **kwargs)
+        self._remember_state()
+
+    def _remember_state(self):
+        # deferred fields are not in __dict__ until they are loaded or set
+        self._loaded_state = {field.attname: self.__dict__[field.attname]
+                              for field in self._meta.concrete_fields if field.attname in self.__dict__}
+        self._deferred_attnames = {field.attname for field in self._meta.concrete_fields
+                                   if field.attname not in self._loaded_state}
+        self._assigned_deferred = set()
+
+    def __setattr__(self, name, value):
+        # loading a deferred field writes to __dict__ directly, only assigning it is a change
+        if name in self.__dict__.get('_deferred_attnames', ()):
+            self._assigned_deferred.add(name)
+        super(Item, self).__setattr__(name, value)
+
+    def changed_fields(self):
+        """
+        :return: names of the fields that were set to a new value since the item was loaded or saved
+        """
+        changed = []
+        for field in self._meta.concrete_fields:
+            if field.attname not in self.__dict__:
+                continue
+            if field.attname in self._loaded_state:
+                if self._loaded_state[field.attname] != self.__dict__[field.attname]:
+                    changed.append(field.name)
+            elif field.attname in self._assigned_deferred:
+                changed.append(field.name)
+        return changed
     
     @property
     def created_as_str(self):
         created = self.created.isoformat().split('+')[0]
         return created + 'Z'
 
-    @cached_property
-    def domain(self):
-        """
-        Domain of the url
-        """
-        return get_tld(self.url, fail_silently=True)
-
     def get_absolute_url(self):
         return reverse('item_view', args=[str(self.id)])
 
@@ -106,7 +382,8 @@ class Item(models.Model):
         return reverse('item_update', args=[str(self.id)])
 
     def get_tag_names(self):
-        return sorted(self.tags.values_list('name', flat=True))
+        # all() returns the prefetched tags without a query if there are any
+        return sorted(tag.name for tag in self.tags.all())
         
     @property
     def tag_names(self):
@@ -118,34 +395,311 @@ class Item(models.Model):
     @tag_names.setter
     def tag_names(self, names):
         if self.tag_names or names:
-            self.tags.set(*names)
+            with changing_tags(self):
+                self.tags.set(*names)
+                # the prefetched tags are outdated now
+                getattr(self, '_prefetched_objects_cache', {}).pop('tags', None)
         else:
             self._tags_to_save = names
 
+    @property
+    def article(self):
+        """
+        Readable article, either the item's own or the one of the shared document
+        """
+        if self.readable_article or self.document_id is None:
+            return self.readable_article
+        return self.document.readable_article
+
+    @article.setter
+    def article(self, value):
+        self.readable_article = value
+
+    @property
+    def safe_text(self):
+        """
+        Escaped article, either the item's own or the one of the shared document
+        """
+        if self.readable_article or self.document_id is None:
+            return self.safe_article
+        return self.document.safe_article
+
     def get_safe_article(self):
-        if self.readable_article:
-            return bleach.clean(self.readable_article, strip=True, tags=[])
-        else:
-            return ''
+        return bleach_article(self.readable_article)
 
     def save(self, *args, **kwargs):
-        self.safe_article = self.get_safe_article()
+        """
+        Saves only the changed fields of existing items, safe_article and the excerpt are only
+        computed again if the article changed.
+        """
+        changed = self.changed_fields()
+        adding = self._state.adding or self.pk is None
+        update_fields = kwargs.get('update_fields')
+        if adding or 'url' in changed or self.domain is None:
+            self.domain = get_domain(self.url)
+            if 'domain' not in changed:
+                changed.append('domain')
+        if adding or 'url' in changed or self.url_hash is None:
+            self.url_hash = hash_url(self.url)
+            if 'url_hash' not in changed:
+                changed.append('url_hash')
+        if adding or 'readable_article' in changed:
+            self.safe_article = self.get_safe_article()
+            changed.append('safe_article')
+            if update_fields is not None and 'readable_article' in update_fields:
+                update_fields = kwargs['update_fields'] = list(update_fields) + ['safe_article']
+        if adding or 'readable_article' in changed or 'document' in changed or self.excerpt is None:
+            self.excerpt = make_excerpt(self.safe_text)
+            if 'excerpt' not in changed:
+                changed.append('excerpt')
+            if update_fields is not None and {'readable_article', 'document'} & set(update_fields):
+                update_fields = kwargs['update_fields'] = list(update_fields) + ['excerpt']
+        if not adding and update_fields is None and not kwargs.get('force_insert'):
+            update_fields = kwargs['update_fields'] = changed
+        if update_fields and 'modified' not in update_fields:
+            # auto_now only sets the date if the field is saved
+            update_fields = kwargs['update_fields'] = list(update_fields) + ['modified']
         super(Item, self).save(*args, **kwargs)
+        if update_fields is None:
+            self._remember_state()
+        else:
+            for name in update_fields:
+                attname = self._meta.get_field(name).attname
+                self._loaded_state[attname] = self.__dict__.get(attname)
 
-    def fetch_article(self):
+    def fetch_article(self, deadline=None, on_title=None, raise_errors=False):
         """
         Fetches a title and a readable_article for the current url.
         It uses the scrapers module for this and only downloads the content.
+        If another item recently fetched the same url, its document is used instead.
+
+        :param deadline: Deadline for the download, defaults to PYPO_FETCH_DEADLINE seconds from now
+        :param on_title: optional function that is called with the title as soon as the
+                         beginning of the page arrived, before the article is parsed
+        :param raise_errors: raise the DownloadException of a failed download instead of
+                             marking the item as failed
+        :raise DownloadDeferred: if the download has to be tried later, the item is unchanged
         """
+        document = Document.objects.fresh(self.url)
+        if document is not None:
+            self.use_document(document)
+            return
+        if deadline is None:
+            deadline = Deadline(settings.PYPO_FETCH_DEADLINE)
+        prefix_callback = None
+        if on_title is not None:
+            def prefix_callback(text):
+                title = extract_title(text)
+                if title:
+                    on_title(title)
         try:
-            dl = download(self.url, max_content_length=settings.PYPO_MAX_CONTENT_LENGTH)
+            dl = domain_scheduler.download(self.url, max_content_length=settings.PYPO_MAX_CONTENT_LENGTH,
+                                           cache=response_cache, deadline=deadline,
+                                           min_partial_length=settings.PYPO_FETCH_MIN_PARTIAL_LENGTH,
+                                           prefix_callback=prefix_callback)
+        except DownloadDeferred:
+            # not a failure of the url, the domain is just busy or failing at the moment
+            raise
         except DownloadException:
+            if raise_errors:
+                raise
+            dl = None
+        self.read_article(dl)
+
+    def read_article(self, dl):
+        """
+        Sets the title and the shared document from downloaded content.
+
+        :param dl: DownloadedContent or None if the download failed
+        """
+        if dl is None:
             # TODO show a message that the download failed?
             self.title = self.url
-            self.readable_article = None
+            self.readable_article = ''
+            self.status = Item.FAILED
         else:
-            self.title, self.readable_article = parse(self, content_type=dl.content_type,
-                                                  text=dl.text, content=dl.content)
+            title, readable_article = parse(self, content_type=dl.content_type,
+                                            text=dl.text, content=dl.content, pool=parser_pool)
+            self.use_document(Document.objects.store(self.url, title, readable_article, dl))
+
+    def save_fetched(self, placeholder_titles=()):
+        """
+        Saves the fields written by fetch_article. The title is only replaced if it did not
+        change since the item was loaded, so a title the user set meanwhile is kept.
+
+        :param placeholder_titles: further titles that may be replaced, e.g. the ones shown
+                                   while the article was fetched
+        """
+        titles = {self._loaded_state.get('title'), self.url}
+        titles.update(placeholder_titles)
+        titles.discard(None)
+        if not Item.objects.filter(pk=self.pk, title__in=titles).update(title=self.title):
+            self.title = Item.objects.filter(pk=self.pk).values_list('title', flat=True).first()
+        self._loaded_state['title'] = self.title
+        # saving updates the search index with the title as well
+        self.save(update_fields=Item.FETCHED_FIELDS)
+
+    def use_document(self, document):
+        """
+        Show the title and article of a shared document
+
+        :param document: Document
+        """
+        self.document = document
+        self.title = document.title
+        # the article is read from the document, no need to store a copy
+        self.readable_article = ''
+        self.status = Item.FETCHED
+        self.parser_version = document.parser_version
+
+
+class FetchJob(models.Model):
+    """
+    Queued download of an item's article, processed by ``manage.py run_fetch_workers``
+    """
+    #:param item Item whose article is fetched
+    item = models.OneToOneField(Item, related_name='fetch_job')
+    #:param created Creating date of the job
+    created = models.DateTimeField(auto_now_add=True)
+    #:param started When a worker claimed the job, None if it is still waiting
+    started = models.DateTimeField(null=True, blank=True)
+    #:param attempts Number of times a worker claimed the job
+    attempts = models.PositiveIntegerField(default=0)
+
+
+class UserTagCountManager(models.Manager):
+
+    def for_user(self, user):
+        """
+        :return: list of (tag name, number of items with the tag) of all items of the user,
+                 the most used tags first
+        """
+        return list(self.filter(user=user, count__gt=0).order_by('-count', 'tag__name')
+                    .values_list('tag__name', 'count'))
+
+    def change(self, user_id, tag_id, delta):
+        """
+        Add delta to the count of a tag, counts that drop to zero are removed
+        """
+        counts = self.filter(user_id=user_id, tag_id=tag_id)
+        if counts.update(count=models.F('count') + delta):
+            if delta < 0:
+                counts.filter(count__lte=0).delete()
+        elif delta > 0:
+            try:
+                with transaction.atomic():
+                    self.create(user_id=user_id, tag_id=tag_id, count=delta)
+            except IntegrityError:
+                # another request created the row in the meantime
+                counts.update(count=models.F('count') + delta)
+
+    def rebuild(self, user=None):
+        """
+        Count the tags of all items again
+
+        :param user: only recount the tags of this user
+        :return: number of counts
+        """
+        tagged = TaggedItem.objects.all()
+        counts = self.all()
+        if user is not None:
+            tagged = tagged.filter(content_object__owner=user)
+            counts = counts.filter(user=user)
+        tagged = tagged.values_list('content_object__owner', 'tag').annotate(count=models.Count('id'))
+        with transaction.atomic():
+            counts.delete()
+            self.bulk_create([UserTagCount(user_id=user_id, tag_id=tag_id, count=count)
+                              for user_id, tag_id, count in tagged])
+        return len(tagged)
+
+
+class UserTagCount(models.Model):
+    """
+    Number of items of a user with a tag, so the tags of all items can be listed without counting them
+    every time. The counts are updated together with the tags, ``manage.py rebuild_tag_counts``
+    recounts them.
+    """
+    user = models.ForeignKey(User, related_name='tag_counts')
+    tag = models.ForeignKey(ItemTag, related_name='user_counts')
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UserTagCountManager()
+
+    class Meta:
+        unique_together = ('user', 'tag')
+
+
+_tag_changes = threading.local()
+
+
+def _items_changing_tags():
+    if not hasattr(_tag_changes, 'item_ids'):
+        _tag_changes.item_ids = set()
+    return _tag_changes.item_ids
+
+
+@contextmanager
+def changing_tags(item):
+    """
+    Change the tags of a saved item with a single update of its modification date and search
+    index entry at the end, instead of one for every added or removed tag.
+    """
+    item_ids = _items_changing_tags()
+    item_ids.add(item.pk)
+    try:
+        yield
+    finally:
+        item_ids.discard(item.pk)
+    tags_changed.send(sender=Item, instance=item)
+
+
+def is_changing_tags(tagged_item):
+    """
+    :return: True if the TaggedItem is changed inside changing_tags(), which handles the change
+    """
+    return tagged_item.content_object_id in _items_changing_tags()
+
+
+def _owner_id(tagged_item):
+    return Item.objects.filter(pk=tagged_item.content_object_id).values_list('owner_id', flat=True).first()
+
+
+@receiver(post_save, sender=TaggedItem)
+def count_added_tag(sender, instance, created, **kwargs):
+    if created:
+        UserTagCount.objects.change(_owner_id(instance), instance.tag_id, 1)
+
+
+@receiver(post_delete, sender=TaggedItem)
+def count_removed_tag(sender, instance, **kwargs):
+    owner_id = _owner_id(instance)
+    # nothing to count if the tag is deleted together with its owner
+    if owner_id is not None:
+        UserTagCount.objects.change(owner_id, instance.tag_id, -1)
+
+
+@receiver([post_save, post_delete], sender=TaggedItem)
+def touch_tagged_item(sender, instance, **kwargs):
+    # changed tags are a change of the item for incremental index updates
+    if not is_changing_tags(instance):
+        Item.objects.filter(pk=instance.content_object_id).update(modified=timezone.now())
+
+
+@receiver(tags_changed, sender=Item)
+def touch_item(sender, instance, **kwargs):
+    Item.objects.filter(pk=instance.pk).update(modified=timezone.now())
+
+
+class IndexUpdate(models.Model):
+    """
+    Item whose entry in the search index is out of date, see :mod:`readme.indexing`
+    """
+    #:param item_id Id of the changed item, which might be deleted already
+    item_id = models.IntegerField(primary_key=True)
+    #:param queued Date of the last change
+    queued = models.DateTimeField(db_index=True)
+    #:param version Incremented by every change, a batch only removes the versions it indexed
+    version = models.PositiveIntegerField(default=0)
 
 
 class UserProfile(models.Model):
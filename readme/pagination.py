@@ -0,0 +1,105 @@
+"""
+Keyset pagination of items, newest first.
+
+Pages are addressed by an opaque cursor that contains the creation date and id of the
+item at the border of the page. Fetching a page is a range scan on the (owner, created)
+index no matter how deep the page is, and there is no count of all items.
+"""
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+OLDER = 'o'
+NEWER = 'n'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, item):
+    """
+    :param direction: OLDER for the items after the item, NEWER for the ones before it
+    :param item: Item at the border of the current page
+    :return: url safe string
+    """
+    position = '{}|{}|{}'.format(direction, item.created.isoformat(), item.id)
+    return urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :param cursor: string returned by encode_cursor
+    :return: (direction, created, id)
+    :raises InvalidCursor: if the cursor was not made by encode_cursor
+    """
+    try:
+        direction, created, item_id = urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        created = parse_datetime(created)
+        item_id = int(item_id)
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        raise InvalidCursor(cursor)
+    if direction not in (OLDER, NEWER) or created is None:
+        raise InvalidCursor(cursor)
+    return direction, created, item_id
+
+
+class CursorPage(object):
+    """
+    Items of one page with the cursors of the neighbouring pages
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        #: Cursor of the page with older items or None
+        self.next_cursor = next_cursor
+        #: Cursor of the page with newer items or None
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def paginate(queryset, cursor, page_size):
+    """
+    :param queryset: Items in any order, the page is ordered by creation date, newest first
+    :param cursor: None for the first page or a cursor of another page
+    :param page_size: number of items per page
+    :return: CursorPage
+    :raises InvalidCursor: if the cursor is malformed
+    """
+    if cursor is None:
+        direction = OLDER
+        items = list(queryset.order_by('-created', '-id')[:page_size + 1])
+    else:
+        direction, created, item_id = decode_cursor(cursor)
+        if direction == OLDER:
+            items = list(queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=item_id))
+                         .order_by('-created', '-id')[:page_size + 1])
+        else:
+            items = list(queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=item_id))
+                         .order_by('created', 'id')[:page_size + 1])
+
+    # one more item than needed tells whether there is another page in this direction
+    more = len(items) > page_size
+    items = items[:page_size]
+    if direction == NEWER:
+        items.reverse()
+    if not items:
+        return CursorPage(items)
+    has_older = more if direction == OLDER else True
+    has_newer = more if direction == NEWER else cursor is not None
+    return CursorPage(items,
+                      next_cursor=encode_cursor(OLDER, items[-1]) if has_older else None,
+                      previous_cursor=encode_cursor(NEWER, items[0]) if has_newer else None)
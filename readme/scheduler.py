@@ -0,0 +1,203 @@
+"""
+Politeness and failure handling for downloads, grouped by domain.
+
+Every domain gets a token bucket that limits its request rate and a circuit breaker that
+stops requests to hosts that keep timing out or failing with server errors. Urls that failed
+that way are remembered for a while, so saving them again fails fast.
+"""
+from urllib.parse import urlsplit
+import threading
+import time
+
+from tld import get_tld
+
+from readme.download import download, DownloadException, DownloadDeferred
+
+
+def domain_of(url):
+    """
+    Domain of the url, the same as Item.domain, or the host if it has no known tld
+
+    :param url: Url
+    :return: String
+    """
+    return get_tld(url, fail_silently=True) or urlsplit(url).netloc.lower()
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average and bursts of up to burst requests
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def reserve(self, max_wait):
+        """
+        Take a token, possibly one that becomes available in the future.
+
+        :param max_wait: seconds the caller is willing to wait
+        :return: seconds to wait before the request or None if that would take longer than max_wait
+        """
+        delay = self.delay()
+        if delay > max_wait:
+            return None
+        self.tokens -= 1
+        return delay
+
+    def delay(self):
+        """
+        :return: seconds until the next token is available
+        """
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return max(0, (1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker(object):
+    """
+    Opens after failure_threshold consecutive failures and rejects requests for reset_timeout
+    seconds. Afterwards a single request is let through, its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened = None
+
+    def allow(self):
+        """
+        :return: True if a request may be sent
+        """
+        if self.opened is None:
+            return True
+        if self.clock() - self.opened >= self.reset_timeout:
+            # half open: let this request through, but keep others out until it reports back
+            self.opened = self.clock()
+            return True
+        return False
+
+    def retry_after(self):
+        """
+        :return: seconds until a request is let through again
+        """
+        if self.opened is None:
+            return 0
+        return max(0, self.opened + self.reset_timeout - self.clock())
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened = self.clock()
+
+
+class DomainScheduler(object):
+    """
+    Wraps download() with a token bucket and a circuit breaker per domain and a cache of
+    recently failed urls. Safe to use from several threads.
+    """
+    max_failed_urls = 10000
+
+    def __init__(self, rate=1.0, burst=5, max_wait=30, failure_threshold=3, reset_timeout=300,
+                 negative_ttl=600, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._breakers = {}
+        # url -> (expiry time, message)
+        self._failed_urls = {}
+
+    def _bucket(self, domain):
+        if domain not in self._buckets:
+            self._buckets[domain] = TokenBucket(self.rate, self.burst, clock=self.clock)
+        return self._buckets[domain]
+
+    def _breaker(self, domain):
+        if domain not in self._breakers:
+            self._breakers[domain] = CircuitBreaker(self.failure_threshold, self.reset_timeout,
+                                                    clock=self.clock)
+        return self._breakers[domain]
+
+    def _recent_failure(self, url, now):
+        failure = self._failed_urls.get(url)
+        if failure is None:
+            return None
+        expires, message = failure
+        if expires <= now:
+            del self._failed_urls[url]
+            return None
+        return message
+
+    def _forget_expired(self, now):
+        for url in list(self._failed_urls):
+            self._recent_failure(url, now)
+
+    def download(self, url, **kwargs):
+        """
+        Download url with download() unless its domain is rate limited or failing.
+        Waiting for the rate limit counts against the deadline passed to download().
+
+        :param url: Url
+        :param kwargs: passed to download()
+        :return: DownloadedContent
+        :raise DownloadDeferred: if the request is rejected because of the rate limit or failures
+        :raise DownloadException: for all other errors
+        """
+        domain = domain_of(url)
+        max_wait = self.max_wait
+        deadline = kwargs.get('deadline')
+        if deadline is not None:
+            max_wait = min(max_wait, deadline.remaining())
+        with self._lock:
+            now = self.clock()
+            message = self._recent_failure(url, now)
+            if message is not None:
+                raise DownloadDeferred('Recently failed: {}'.format(message), self._failed_urls[url][0] - now)
+            breaker = self._breaker(domain)
+            if not breaker.allow():
+                raise DownloadDeferred('Too many failures for {}, not trying again yet'.format(domain),
+                                       breaker.retry_after())
+            bucket = self._bucket(domain)
+            delay = bucket.reserve(max_wait)
+            if delay is None:
+                raise DownloadDeferred('Rate limit for {} exceeded'.format(domain), bucket.delay())
+        if delay:
+            self.sleep(delay)
+
+        host_failure = None
+        try:
+            return download(url, **kwargs)
+        except DownloadException as e:
+            if e.is_host_failure:
+                host_failure = e
+            raise
+        finally:
+            with self._lock:
+                if host_failure is None:
+                    # the host answered, even if the content was unusable. This also closes the
+                    # circuit after a probe that allow() let through.
+                    breaker.success()
+                else:
+                    breaker.failure()
+                    now = self.clock()
+                    if len(self._failed_urls) >= self.max_failed_urls:
+                        self._forget_expired(now)
+                    self._failed_urls[url] = (now + self.negative_ttl, host_failure.message)
@@ -1,4 +1,55 @@
-from lxml.html import document_fromstring
+from html import escape
+from itertools import count
+from urllib.parse import urlsplit, unquote
+import codecs
+import logging
+import multiprocessing
+import re
+import resource
+import signal
+import threading
+
+from lxml.etree import ParserError
+from lxml.html import document_fromstring, HTMLParser
+
+from readme.download import mime_type
+
+try:
+    from html import unescape
+except ImportError:
+    # Python 3.3
+    from html.parser import HTMLParser as _EntityParser
+    unescape = _EntityParser().unescape
+
+try:
+    from readability import Document
+    from readability.readability import Unparseable
+    from readability.cleaners import html_cleaner
+except ImportError:
+    Document = None
+else:
+    class TreeDocument(Document):
+        """
+        readability Document that copies an already parsed tree instead of parsing text,
+        readability needs a fresh copy for every try because it modifies the tree.
+        """
+
+        def _parse(self, input):
+            # clean_html works on a copy
+            doc = html_cleaner.clean_html(input)
+            doc.resolve_base_href()
+            return doc
+
+#: Increase whenever a parser changes its results, manage.py reextract updates articles
+#: that were parsed by an older version
+PARSER_VERSION = 1
+
+utf8_parser = HTMLParser(encoding='utf-8')
+title_pattern = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+meta_pattern = re.compile(r'<meta\s[^>]*>', re.IGNORECASE)
+og_title_pattern = re.compile(r'''property\s*=\s*["']og:title["']''', re.IGNORECASE)
+content_pattern = re.compile(r'''content\s*=\s*(?:"([^"]*)"|'([^']*)')''', re.IGNORECASE)
+parser_log = logging.getLogger('readme.scrapers')
 
 
 class ParserException(Exception):
@@ -9,7 +60,100 @@ class ParserException(Exception):
     pass
 
 
-def parse(item, content_type, text=None, content=None):
+class _DomainNode(object):
+    __slots__ = ('children', 'parsers')
+
+    def __init__(self):
+        self.children = {}
+        # (-priority, has no path, registration order, path, func), sorted
+        self.parsers = []
+
+
+class ParserRegistry(object):
+    """
+    Finds the parser for an url. A parser registered for a domain also handles its
+    subdomains. Parsers for the longest matching domain are tried first, among them the
+    ones with the highest priority and of those the ones with a path predicate. The first
+    one whose predicate accepts the path of the url wins.
+
+    Domains are stored in a trie of their reversed labels, so a lookup takes one step
+    per label of the host no matter how many parsers are registered.
+
+    Other packages can announce parser modules with the entry point group ``pypo.parsers``,
+    they are imported on the first lookup and register their parsers with domain_parser.
+    """
+    entry_point_group = 'pypo.parsers'
+
+    def __init__(self):
+        self._root = _DomainNode()
+        self._order = count()
+        self._lock = threading.Lock()
+        self._plugins_loaded = False
+
+    def register(self, domain, func, path=None, priority=0):
+        """
+        :param domain: String, e.g. github.com or gist.github.com
+        :param func: parser
+        :param path: optional path prefix or callable that gets the path and returns a bool
+        :param priority: parsers with a higher priority are tried first
+        """
+        node = self._root
+        for label in reversed(domain.lower().strip('.').split('.')):
+            node = node.children.setdefault(label, _DomainNode())
+        node.parsers.append((-priority, path is None, next(self._order), path, func))
+        node.parsers.sort(key=lambda parser: parser[:3])
+
+    def find(self, url):
+        """
+        :param url: Url
+        :return: parser function or None
+        """
+        self.load_plugins()
+        parts = urlsplit(url)
+        host, path = (parts.hostname or ''), parts.path or '/'
+        matches = []
+        node = self._root
+        for label in reversed(host.split('.')):
+            node = node.children.get(label)
+            if node is None:
+                break
+            if node.parsers:
+                matches.append(node)
+        for node in reversed(matches):
+            for _, _, _, predicate, func in node.parsers:
+                if predicate is None:
+                    return func
+                if callable(predicate):
+                    if predicate(path):
+                        return func
+                elif path.startswith(predicate):
+                    return func
+        return None
+
+    def load_plugins(self):
+        """
+        Import the parser modules of the entry point group once
+        """
+        if self._plugins_loaded:
+            return
+        with self._lock:
+            if self._plugins_loaded:
+                return
+            try:
+                from pkg_resources import iter_entry_points
+            except ImportError:
+                entry_points = []
+            else:
+                entry_points = iter_entry_points(self.entry_point_group)
+            for entry_point in entry_points:
+                try:
+                    entry_point.load()
+                except Exception:
+                    parser_log.exception('Could not load parser plugin %s', entry_point)
+            self._plugins_loaded = True
+
+
+def parse(item, content_type, text=None, content=None, pool=None, raise_errors=False):
     """
     Scrape info from an item
 
@@ -17,75 +161,246 @@ def parse(item, content_type, text=None, content=None):
     :param text: unicode text
     :param content: byte string
     :param item: Item
+    :param pool: optional ParserPool that runs the parser in another process
+    :param raise_errors: raise a ParserException instead of returning the url as title
+                         and an empty article if the content could not be parsed
     """
     try:
-        domain = item.domain
+        mime = mime_type(content_type or '')
+        content_parser = parse.content_types.get(mime) or parse.content_types.get(mime.split('/')[0] + '/*')
+        if content_parser is not None:
+            return content_parser(item, content_type, text, content)
         if text is not None:
-            if domain in parse.domains:
-                return parse.domains[domain](item, content_type, text)
-            else:
-                return parse_web_page(text)
+            if pool is None:
+                return parse_text(item, content_type, text)
+            return pool.apply(parse_text, item, content_type, text)
     except ParserException:
-        pass
+        if raise_errors:
+            raise
+    else:
+        if raise_errors:
+            raise ParserException('No parser for {}'.format(content_type))
     return item.url, ''
 
 
-parse.domains = {}
+parse.registry = ParserRegistry()
+# mime type or major type like image/* -> parser for content that is not html
+parse.content_types = {}
 
 
-def domain_parser(domain):
+def parse_text(item, content_type, text):
+    """
+    Parse the text into a tree once and hand it to the registered parser for the
+    item's url or to readability.
+
+    :param item: Item
+    :param content_type: mime type
+    :param text: unicode text
+    :return: title, article
+    :raise ParserException:
     """
-    Decorator to register a domain specific parser
+    tree = parse_tree(text)
+    parser = parse.registry.find(item.url)
+    if parser is not None:
+        return parser(item, content_type, tree)
+    return parse_web_page(tree)
+
+
+def extract_title(text):
+    """
+    Find the title in the beginning of a page without parsing it, a og:title meta tag wins
+    over the title tag. Used to show a title before the whole page is parsed.
+
+    :param text: unicode text, possibly only the first few KB of the page
+    :return: title or None
+    """
+    if not text:
+        return None
+    for meta in meta_pattern.findall(text):
+        if og_title_pattern.search(meta):
+            match = content_pattern.search(meta)
+            if match:
+                title = ' '.join(unescape(match.group(1) or match.group(2) or '').split())
+                if title:
+                    return title
+    match = title_pattern.search(text)
+    if match:
+        return ' '.join(unescape(match.group(1)).split()) or None
+    return None
+
+
+def parse_tree(text):
+    """
+    :param text: unicode text
+    :return: lxml.html.HtmlElement
+    :raise ParserException: if there is no document
+    """
+    if not text:
+        raise ParserException('No decoded text available, aborting!')
+    try:
+        # lxml refuses unicode with an encoding declaration, so parse utf-8 like readability does
+        return document_fromstring(text.encode('utf-8', 'replace'), parser=utf8_parser)
+    except (ParserError, ValueError) as e:
+        raise ParserException(str(e))
+
+
+def domain_parser(domain, path=None, priority=0):
+    """
+    Decorator to register a parser for a domain and its subdomains. It is called with
+    the item, the content type and the parsed lxml tree of the page.
 
     :param domain: String
+    :param path: optional path prefix or predicate, see ParserRegistry.register
+    :param priority: Integer, higher is tried first
     :return: function
     """
     def decorator(func):
-        parse.domains[domain] = func
+        parse.registry.register(domain, func, path=path, priority=priority)
         return func
     return decorator
 
 
-def parse_web_page(text):
+def content_type_parser(*mime_types):
+    """
+    Decorator to register a parser for content that is not html, it wins over the domain
+    parsers. It is called with the item, the content type, the text (None for binary
+    content) and the downloaded bytes, which are only the beginning or None for most binary types.
+
+    :param mime_types: Strings like text/plain or image/*
+    :return: function
+    """
+    def decorator(func):
+        for mime in mime_types:
+            parse.content_types[mime] = func
+        return func
+    return decorator
+
+
+def _limit_memory(memory_limit):
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _cpu_time_exceeded(signum, frame):
+    raise ParserException('Parser exceeded its cpu time')
+
+
+def _run_limited(cpu_timeout, func, *args):
+    signal.signal(signal.SIGPROF, _cpu_time_exceeded)
+    signal.setitimer(signal.ITIMER_PROF, cpu_timeout)
+    try:
+        return func(*args)
+    except MemoryError:
+        raise ParserException('Parser ran out of memory')
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+class ParserPool(object):
+    """
+    Runs parsers in worker processes, so huge or broken pages neither block nor bloat
+    the calling process. Every task gets cpu_timeout seconds of cpu time, the address space
+    of the workers is limited to memory_limit bytes and they are replaced after max_tasks tasks.
+    The processes are started on first use, callers wait while all of them are busy.
+    """
+
+    def __init__(self, processes=2, cpu_timeout=10, memory_limit=1024 ** 3, max_tasks=100):
+        self.processes = processes
+        self.cpu_timeout = cpu_timeout
+        self.memory_limit = memory_limit
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        # one task per process, so the timeout of a task does not include waiting for a worker
+        self._slots = threading.BoundedSemaphore(processes)
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes, initializer=_limit_memory,
+                                                  initargs=(self.memory_limit,),
+                                                  maxtasksperchild=self.max_tasks)
+            return self._pool
+
+    def apply(self, func, *args):
+        """
+        Call func(*args) in a worker process, func and args have to be picklable
+
+        :return: the result of func
+        :raise ParserException: if the parser failed, ran out of time or memory
+        """
+        with self._slots:
+            pool = self._get_pool()
+            result = pool.apply_async(_run_limited, (self.cpu_timeout, func) + args)
+            try:
+                # The cpu time is limited by the worker itself, this catches workers that hang without using it
+                return result.get(self.cpu_timeout * 2)
+            except multiprocessing.TimeoutError:
+                self._retire(pool)
+                raise ParserException('Parser timed out')
+
+    def _retire(self, pool):
+        """
+        Replace a pool with a hanging worker. The tasks that already run in it may finish,
+        afterwards the pool is stopped together with the hanging worker.
+        """
+        with self._lock:
+            if self._pool is not pool:
+                # already replaced because of another task that timed out
+                return
+            self._pool = None
+        pool.close()
+        # the tasks of other threads were started before this one timed out, so they are done by then
+        stopper = threading.Timer(self.cpu_timeout * 2, _stop_pool, (pool,))
+        stopper.daemon = True
+        stopper.start()
+
+    def close(self):
+        """
+        Stop all workers, the next task starts new ones
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            _stop_pool(pool)
+
+
+def _stop_pool(pool):
+    pool.terminate()
+    pool.join()
+
+
+def parse_web_page(tree):
     """
     Generic wep page parser with readability.
     Used as a fallback.
 
-    :param text: unicode text
+    :param tree: lxml tree of the page, it is not modified
     :return: title, article
     :raise ParserException:
     """
-    try:
-        from readability import Document
-        from readability.readability import Unparseable
-    except ImportError:
+    if Document is None:
         raise ParserException('readability is not installed')
 
-    if not text:
-        raise ParserException('No decoded text available, aborting!')
+    doc = TreeDocument(tree)
     try:
-        doc = Document(text)
-    except Unparseable as e:
-        raise ParserException(e.message)
-    else:
         return doc.short_title(), doc.summary(True)
+    except Unparseable as e:
+        raise ParserException(str(e))
 
 
 @domain_parser('github.com')
 @domain_parser('bitbucket.org')
-def parse_github(item, content_type, text):
+def parse_github(item, content_type, doc):
     """
     Reads the readme of a repo if it can find one.
 
     :param item:  ignored
     :param content_type: ignored
-    :param text: unicode text
+    :param doc: lxml tree
     :return: title, article
     :raise ParserException: raised of no readme is found
     """
-    if text is None:
-        raise ParserException('Could not decode content')
-    doc = document_fromstring(text)
     readme_elements = doc.cssselect('#readme article')
     if readme_elements:
         readme = readme_elements[0]
@@ -101,3 +416,94 @@ def parse_github(item, content_type, text):
     else:
         raise ParserException('title not found')
     return title, article
+
+
+def file_name(url):
+    """
+    :param url: Url
+    :return: the last part of the path or the url if it has none
+    """
+    name = unquote(urlsplit(url).path.rstrip('/').rpartition('/')[2])
+    return name or url
+
+
+@content_type_parser('text/plain', 'text/markdown', 'text/csv', 'application/json')
+def parse_plain_text(item, content_type, text, content):
+    """
+    Shows plain text as it is, the first line is the title
+
+    :return: title, article
+    :raise ParserException: if there is no text
+    """
+    if not text or not text.strip():
+        raise ParserException('No decoded text available, aborting!')
+    title = text.strip().splitlines()[0].strip()[:200]
+    return title, '<pre>{}</pre>'.format(escape(text))
+
+
+@content_type_parser('application/xml', 'text/xml', 'application/rss+xml', 'application/atom+xml')
+def parse_xml(item, content_type, text, content):
+    """
+    Shows xml as plain text instead of guessing an article from its markup, it is named after its file
+
+    :return: title, article
+    :raise ParserException: if there is no text
+    """
+    title, article = parse_plain_text(item, content_type, text, content)
+    return file_name(item.url), article
+
+
+@content_type_parser('image/*', 'audio/*', 'video/*', 'application/zip', 'application/octet-stream')
+def parse_binary(item, content_type, text, content):
+    """
+    Names binary content after its file, its body is not downloaded
+
+    :return: title, empty article
+    """
+    return file_name(item.url), ''
+
+
+pdf_info_title_pattern = re.compile(rb'/Title\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)', re.DOTALL)
+pdf_xmp_title_pattern = re.compile(rb'<dc:title>.*?<rdf:li[^>]*>(.*?)</rdf:li>', re.DOTALL)
+pdf_escapes = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def _pdf_string(value):
+    """
+    :param value: literal (in parentheses) or hex string (in angle brackets) of a pdf
+    :return: unicode text
+    """
+    if value.startswith(b'<'):
+        raw = bytes.fromhex(re.sub(rb'\s', b'', value[1:-1]).decode('ascii'))
+    else:
+        def unescape_char(match):
+            escaped = match.group(1)
+            if escaped[:1].isdigit():
+                return bytes([int(escaped, 8) & 0xff])
+            return pdf_escapes.get(escaped, escaped)
+        raw = re.sub(rb'\\([0-7]{1,3}|.)', unescape_char, value[1:-1], flags=re.DOTALL)
+    if raw.startswith(codecs.BOM_UTF16_BE):
+        return raw[2:].decode('utf-16-be', errors='ignore')
+    # close enough to PDFDocEncoding
+    return raw.decode('latin1')
+
+
+@content_type_parser('application/pdf')
+def parse_pdf(item, content_type, text, content):
+    """
+    Reads the title from the document info or the XMP metadata in the beginning of a pdf,
+    the article stays empty.
+
+    :return: title, empty article
+    """
+    title = None
+    if content:
+        match = pdf_info_title_pattern.search(content)
+        if match:
+            title = _pdf_string(match.group(1))
+        else:
+            match = pdf_xmp_title_pattern.search(content)
+            if match:
+                title = unescape(match.group(1).decode('utf-8', errors='ignore'))
+    title = ' '.join((title or '').split())
+    return title or file_name(item.url), ''
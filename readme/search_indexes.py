@@ -8,16 +8,22 @@ class ItemIndex(indexes.SearchIndex, indexes.Indexable):
     created = indexes.DateTimeField(model_attr='created')
     owner_id = indexes.IntegerField(model_attr='owner_id')
     tags = indexes.MultiValueField(faceted=True)
+    domain = indexes.CharField(model_attr='domain', faceted=True, null=True)
 
     def prepare_tags(self, obj):
         if not type(obj.tags) is list:
-            return list(obj.tags.names())
+            # uses the tags of Item.objects.with_tag_names() when indexing many items
+            return obj.get_tag_names()
         else:
             return obj.tags
 
     def get_model(self):
         return Item
 
+    def get_updated_field(self):
+        """Lets update_index --age and reindex_items --age only index recently changed items."""
+        return 'modified'
+
     def index_queryset(self, using=None):
         """Used when the entire index for model is updated."""
         return self.get_model().objects.all()
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers
 from .models import Item
+from .jobs import schedule_fetch
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
@@ -23,16 +24,39 @@ class TagSerializer(serializers.Field):
 class ItemSerializer(serializers.ModelSerializer):
     tags = TagSerializer(source='tag_names') 
     title = serializers.CharField(required=False)
-    readable_article = serializers.CharField(required=False)
+    readable_article = serializers.CharField(source='article', required=False)
+    status = serializers.CharField(read_only=True)
     class Meta:
         model = Item
-        fields = ('id', 'url', 'title', 'created', 'readable_article', 'tags')
-        
+        fields = ('id', 'url', 'title', 'created', 'readable_article', 'tags', 'status')
+
+    def __init__(self, *args, **kwargs):
+        super(ItemSerializer, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        fields = self.requested_fields(request) if request is not None else None
+        if fields is not None:
+            for name in set(self.fields.keys()) - fields:
+                del self.fields[name]
+
+    @staticmethod
+    def requested_fields(request):
+        """
+        Fields of the response given as ?fields=id,title, only for reading requests
+
+        :return: set of field names or None for all fields
+        """
+        fields = request.query_params.get('fields')
+        if request.method != 'GET' or not fields:
+            return None
+        return {name.strip() for name in fields.split(',')}
+
     def create(self, validated_data):
         tags = validated_data.pop('tag_names')
         item = Item(**validated_data)
-        item.fetch_article()
+        if not item.title:
+            item.title = item.url
+        item.status = Item.PENDING
         item.save()
         item.tag_names = tags
-        item.save()
+        schedule_fetch(item)
         return item
@@ -1,15 +1,62 @@
+from django.conf import settings
 from django.db import models
-from readme.models import Item
+from readme.models import Item, TaggedItem, tags_changed, is_changing_tags
 from haystack import signals
+from readme.indexing import queue_index_update
 
 
 class ItemOnlySignalProcessor(signals.BaseSignalProcessor):
     def setup(self):
-        # Listen only to the ``User`` model.
+        # Listen only to the ``Item`` model and its tags.
         models.signals.post_save.connect(self.handle_save, sender=Item)
         models.signals.post_delete.connect(self.handle_delete, sender=Item)
+        models.signals.post_save.connect(self.handle_tag_change, sender=TaggedItem)
+        models.signals.post_delete.connect(self.handle_tag_change, sender=TaggedItem)
+        tags_changed.connect(self.handle_save, sender=Item)
 
     def teardown(self):
-        # Disconnect only for the ``User`` model.
+        # Disconnect only for the ``Item`` model and its tags.
         models.signals.post_save.disconnect(self.handle_save, sender=Item)
         models.signals.post_delete.disconnect(self.handle_delete, sender=Item)
+        models.signals.post_save.disconnect(self.handle_tag_change, sender=TaggedItem)
+        models.signals.post_delete.disconnect(self.handle_tag_change, sender=TaggedItem)
+        tags_changed.disconnect(self.handle_save, sender=Item)
+
+    def handle_tag_change(self, sender, instance, **kwargs):
+        """
+        Update the index of an item whose tags changed, so it does not have to be saved again.
+        Changes inside readme.models.changing_tags() are indexed once at the end.
+        """
+        if is_changing_tags(instance):
+            return
+        item = Item.objects.filter(pk=instance.content_object_id).first()
+        # the item is gone if the tag was deleted together with it
+        if item is not None:
+            self.handle_save(Item, item)
+
+
+class QueuedSignalProcessor(ItemOnlySignalProcessor):
+    """
+    Records changed items for ``manage.py run_indexer`` instead of indexing them while the
+    request is handled. Indexes right away like ItemOnlySignalProcessor if
+    PYPO_INDEX_IN_BACKGROUND is disabled.
+    """
+    def handle_save(self, sender, instance, **kwargs):
+        if settings.PYPO_INDEX_IN_BACKGROUND:
+            queue_index_update(instance.pk)
+        else:
+            super(QueuedSignalProcessor, self).handle_save(sender, instance, **kwargs)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        if settings.PYPO_INDEX_IN_BACKGROUND:
+            queue_index_update(instance.pk)
+        else:
+            super(QueuedSignalProcessor, self).handle_delete(sender, instance, **kwargs)
+
+    def handle_tag_change(self, sender, instance, **kwargs):
+        if is_changing_tags(instance):
+            return
+        if settings.PYPO_INDEX_IN_BACKGROUND:
+            queue_index_update(instance.content_object_id)
+        else:
+            super(QueuedSignalProcessor, self).handle_tag_change(sender, instance, **kwargs)
@@ -1,12 +1,27 @@
-from .models import Item
-from conftest import QUEEN
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Item, UserTagCount
+from conftest import QUEEN, add_example_item
 
 EXAMPLE_COM = 'http://www.example.com/'
 
-def test_unknown_tld():
-    item = Item()
+def test_unknown_tld(user):
+    item = Item(owner=user)
     item.url = 'foobar'
-    assert item.domain is None
+    item.save()
+    assert item.domain == ''
+
+
+def test_domain_is_computed_on_save(user):
+    item = Item.objects.create(url='http://www.example.co.uk/page', owner=user)
+    assert Item.objects.get(domain='example.co.uk') == item
+    item.url = 'https://lwn.net/Articles/1/'
+    item.save()
+    assert Item.objects.get(pk=item.pk).domain == 'lwn.net'
 
 
 def test_find_items_by_tag(user, simple_items):
@@ -37,8 +52,51 @@ def test_excluding_tags(user, tagged_items):
     queryset = Item.objects.filter(owner_id=user.id).tagged(QUEEN).without(QUEEN)
     assert len(queryset) == 0
 
+def test_excluding_many_tags_needs_one_query(user, tagged_items):
+    excluded = [QUEEN] + ['unused-{}'.format(i) for i in range(20)]
+    queryset = Item.objects.filter(owner_id=user.id).without(*excluded)
+    with CaptureQueriesContext(connection) as queries:
+        assert len(queryset) == 2
+    assert len(queries) == 1
+
+
+def test_tagged_with_an_unknown_tag_is_empty(user, simple_items):
+    assert not simple_items['filter'].tagged(QUEEN, 'no-such-tag').exists()
+
+
+def test_tagged_ignores_repeated_tags(user, simple_items):
+    assert simple_items['item_fish'] == simple_items['filter'].tagged(QUEEN, 'fish', QUEEN).get()
+
+
+def test_tag_counts(user, simple_items):
+    assert simple_items['filter'].tag_counts() == [(QUEEN, 2), ('box', 1), ('cookie', 1), ('fish', 1)]
+    assert simple_items['filter'].tagged('fish').tag_counts() == [('cookie', 1), ('fish', 1), (QUEEN, 1)]
+
+
 def test_tag_names_property(user, simple_items):
     item = simple_items['item_fish']
     names = ["bar", "baz", "foo"]
     item.tag_names = names
     assert item.tag_names == names
+
+
+def test_tag_counts_follow_tag_changes(user, simple_items):
+    assert UserTagCount.objects.for_user(user) == simple_items['filter'].tag_counts()
+    item = simple_items['item_fish']
+    item.tag_names = ['fish', 'new']
+    assert UserTagCount.objects.for_user(user) == simple_items['filter'].tag_counts()
+    Item.objects.filter(pk=simple_items['item_box'].pk).delete()
+    assert UserTagCount.objects.for_user(user) == [('fish', 1), ('new', 1)]
+
+
+def test_tag_counts_are_per_user(user, other_user, simple_items):
+    add_example_item(other_user, ['fish'])
+    assert ('fish', 1) in UserTagCount.objects.for_user(user)
+    assert UserTagCount.objects.for_user(other_user) == [('fish', 1)]
+
+
+def test_rebuild_tag_counts(user, simple_items):
+    expected = UserTagCount.objects.for_user(user)
+    UserTagCount.objects.all().update(count=42)
+    call_command('rebuild_tag_counts', stdout=StringIO())
+    assert UserTagCount.objects.for_user(user) == expected
@@ -1,32 +1,228 @@
-from django.core.paginator import Page
 from haystack.query import SearchQuerySet
 from unittest.mock import Mock
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.core.urlresolvers import reverse, resolve
+from django.utils import timezone
 import requests
 from sitegate.models import InvitationCode
-from .models import Item
+from .models import Item, FetchJob, Document, IndexUpdate
+from readme import jobs, indexing
+from readme.bulk import fetch_many
+from readme.scheduler import DomainScheduler, TokenBucket
 from readme.forms import CreateItemForm
-from readme.scrapers import parse
+from readme.scrapers import parse, extract_title, parse_tree, parse_web_page, ParserPool, ParserException, ParserRegistry, \
+    PARSER_VERSION
 from readme import download
 from readme.views import Tag
 from conftest import add_example_item, QUEEN
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from datetime import timedelta
 import json
+import os
+import re
+import socket
+import threading
+import time
 
 import pytest
 
 EXAMPLE_COM = 'http://www.example.com/'
+DEFAULT_TIMEOUT = (download.CONNECT_TIMEOUT, download.READ_TIMEOUT)
 
 def test_invalid_html(user):
     item = Item.objects.create(url='http://some_invalid_localhost', title='nothing', owner=user)
     assert (item.url, '') == parse(item, content_type='text/html', text=None)
 
+def _spin():
+    while True:
+        pass
+
+def _use_cpu(seconds):
+    started = time.process_time()
+    while time.process_time() - started < seconds:
+        pass
+    return seconds
+
+def _sleep_and_return(seconds, result):
+    time.sleep(seconds)
+    return result
+
+@pytest.fixture
+def parser_pool(request):
+    pool = ParserPool(processes=1, cpu_timeout=0.5)
+    request.addfinalizer(pool.close)
+    return pool
+
+def test_parser_pool_parses_pages(parser_pool):
+    item = Item(url=EXAMPLE_COM)
+    text = '<html><head><title>pooled</title></head><body><p>{}</p></body></html>'.format('text ' * 100)
+    title, article = parse(item, content_type='text/html', text=text, pool=parser_pool)
+    assert title == 'pooled'
+    assert 'text text' in article
+
+def test_parser_pool_limits_cpu_time(parser_pool):
+    with pytest.raises(ParserException):
+        parser_pool.apply(_spin)
+    # the worker survives the timeout
+    assert parser_pool.apply(len, 'abc') == 3
+
+def test_parser_pool_timeout_does_not_include_waiting_for_a_worker(parser_pool):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(parser_pool.apply(_use_cpu, 0.4)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [0.4] * 3
+
+def test_parser_pool_timeouts_do_not_stop_other_tasks():
+    pool = ParserPool(processes=2, cpu_timeout=0.5)
+    try:
+        # a worker that hangs without using cpu time
+        hanging = threading.Thread(target=lambda: pytest.raises(ParserException, pool.apply, time.sleep, 60))
+        hanging.start()
+        time.sleep(0.5)
+        # still running in the old pool when the hanging task times out
+        assert pool.apply(_sleep_and_return, 0.6, 'done') == 'done'
+        hanging.join()
+        assert pool.apply(len, 'abc') == 3
+    finally:
+        pool.close()
+
+def test_web_page_parser_does_not_modify_the_tree():
+    tree = parse_tree('<html><head><title>tree</title><script>x = 1;</script></head>'
+                      '<body><p>{}</p></body></html>'.format('text ' * 100))
+    title, article = parse_web_page(tree)
+    assert title == 'tree'
+    assert 'text text' in article
+    assert tree.cssselect('script')
+
+def test_domain_parsers_get_the_parsed_tree():
+    item = Item(url='https://github.com/audax/pypo')
+    text = '<html><head><title>audax/pypo</title></head><body><div id="readme"><article>' \
+           '<h1>pypo</h1>Read it later</article></div></body></html>'
+    assert parse(item, content_type='text/html', text=text) == ('audax/pypo', 'Read it later')
+
+def test_parser_registry_matches_subdomains():
+    registry = ParserRegistry()
+    registry.register('github.com', 'repo')
+    registry.register('gist.github.com', 'gist')
+    assert registry.find('https://www.github.com/audax/pypo') == 'repo'
+    assert registry.find('https://gist.github.com/audax/1') == 'gist'
+    assert registry.find('https://notgithub.com/') is None
+    assert registry.find('https://com/') is None
+
+def test_parser_registry_checks_paths_and_priorities():
+    registry = ParserRegistry()
+    registry.register('example.com', 'fallback')
+    registry.register('example.com', 'blog', path='/blog/')
+    registry.register('example.com', 'feed', path=lambda path: path.endswith('.rss'), priority=1)
+    assert registry.find('http://example.com/blog/post') == 'blog'
+    assert registry.find('http://example.com/blog/feed.rss') == 'feed'
+    assert registry.find('http://example.com/about') == 'fallback'
+
+def test_parser_registry_loads_plugins_once(monkeypatch):
+    registry = ParserRegistry()
+    entry_point = Mock()
+    entry_point.load.side_effect = lambda: registry.register('example.com', 'plugin')
+    iter_entry_points = Mock(return_value=[entry_point])
+    monkeypatch.setattr('pkg_resources.iter_entry_points', iter_entry_points)
+    assert registry.find(EXAMPLE_COM) == 'plugin'
+    assert registry.find(EXAMPLE_COM) == 'plugin'
+    iter_entry_points.assert_called_once_with('pypo.parsers')
+
+def test_extract_title_from_the_beginning_of_a_page():
+    assert extract_title('<html><head><title>\n A &amp; B </title>') == 'A & B'
+    assert extract_title('<meta property="og:title" content="Open &quot;Graph&quot;">'
+                         '<title>plain</title>') == 'Open "Graph"'
+    assert extract_title("<meta content='Reversed' property='og:title'><title>plain</title>") == 'Reversed'
+    assert extract_title('<html><head><title>cut off') is None
+    assert extract_title(None) is None
+
+def test_plain_text_is_not_parsed_as_html():
+    item = Item(url=EXAMPLE_COM + 'notes.txt')
+    assert parse(item, content_type='text/plain; charset=utf-8', text='\n Notes\n<b>bold</b>') == (
+        'Notes', '<pre>\n Notes\n&lt;b&gt;bold&lt;/b&gt;</pre>')
+
+def test_xml_is_not_parsed_as_html():
+    item = Item(url=EXAMPLE_COM + 'notes.xml')
+    text = '<?xml version="1.0"?>\n<notes><p>first</p></notes>'
+    for content_type in ('application/xml; charset=utf-8', 'text/xml'):
+        assert parse(item, content_type=content_type, text=text) == (
+            'notes.xml', '<pre>&lt;?xml version=&quot;1.0&quot;?&gt;\n&lt;notes&gt;&lt;p&gt;first&lt;/p&gt;&lt;/notes&gt;</pre>')
+
+def test_binary_content_is_named_after_its_file():
+    item = Item(url=EXAMPLE_COM + 'images/cat%20photo.jpg')
+    assert parse(item, content_type='image/jpeg') == ('cat photo.jpg', '')
+
+def test_pdf_title_is_read_from_its_metadata():
+    item = Item(url=EXAMPLE_COM + 'paper.pdf')
+    info = b'%PDF-1.4\n1 0 obj << /Title (A \\(small\\) paper\\041) /Author (Jo) >> endobj'
+    assert parse(item, content_type='application/pdf', content=info) == ('A (small) paper!', '')
+    utf16 = b'<< /Title <FEFF00DC0062006500720020> >>'
+    assert parse(item, content_type='application/pdf', content=utf16) == ('\xdcber', '')
+    xmp = b'<dc:title><rdf:Alt><rdf:li xml:lang="x-default">Fish &amp; Chips</rdf:li></rdf:Alt></dc:title>'
+    assert parse(item, content_type='application/pdf', content=xmp) == ('Fish & Chips', '')
+    assert parse(item, content_type='application/pdf', content=b'%PDF-1.4') == ('paper.pdf', '')
+
 def test_html_is_bleached(user):
     content = b'\r\n<script>alert(1);</script>foobar\r\n3>5'
     item = Item.objects.create(url='http://some_invalid_localhost', title='nothing', owner=user,
                                readable_article=content)
     assert '\nalert(1);foobar\n3&gt;5' == item.safe_article
 
+def test_article_is_only_bleached_if_it_changed(user, monkeypatch):
+    item = Item.objects.create(url=EXAMPLE_COM, title='nothing', owner=user, readable_article='<p>a</p>')
+    calls = []
+    monkeypatch.setattr(Item, 'get_safe_article', lambda self: calls.append(self) or 'bleached')
+    item.title = 'changed'
+    item.save()
+    assert calls == []
+    item.article = '<p>b</p>'
+    item.save()
+    assert len(calls) == 1
+    assert Item.objects.get(pk=item.pk).safe_article == 'bleached'
+
+def test_save_only_writes_changed_fields(user):
+    item = Item.objects.create(url=EXAMPLE_COM, title='nothing', owner=user)
+    # changed by a fetch worker in the meantime
+    Item.objects.filter(pk=item.pk).update(status=Item.FAILED)
+    item.title = 'changed'
+    item.save()
+    item = Item.objects.get(pk=item.pk)
+    assert (item.title, item.status) == ('changed', Item.FAILED)
+    assert item.changed_fields() == []
+
+def test_loading_deferred_fields_is_not_a_change(user):
+    Item.objects.create(url=EXAMPLE_COM, title='nothing', owner=user, readable_article='<p>a</p>')
+    item = Item.objects.for_list().get()
+    assert item.readable_article == '<p>a</p>'
+    assert item.changed_fields() == []
+    item.safe_article = 'assigned'
+    assert item.changed_fields() == ['safe_article']
+
+def test_replacing_tags_updates_the_index_once(user, settings, monkeypatch):
+    settings.PYPO_INDEX_IN_BACKGROUND = True
+    item = Item.objects.create(url=EXAMPLE_COM, title='nothing', owner=user)
+    item.tag_names = ['one', 'two']
+    queued = []
+    monkeypatch.setattr('readme.signals.queue_index_update', queued.append)
+    item.tag_names = ['three', 'four', 'five']
+    assert queued == [item.id]
+    assert Item.objects.get().tag_names == ['five', 'four', 'three']
+
+def test_tag_changes_update_the_index(user):
+    item = Item.objects.create(url=EXAMPLE_COM, title='nothing', owner=user)
+    item.tags.add('indexed-tag')
+    assert SearchQuerySet().filter(owner_id=user.id).auto_query('indexed-tag').count() == 1
+    item.tags.remove('indexed-tag')
+    assert SearchQuerySet().filter(owner_id=user.id).auto_query('indexed-tag').count() == 0
+
 def test_item_access_restricted_to_owners(client, db):
     item = Item.objects.create(url='http://some_invalid_localhost', title='nothing',
                                owner=User.objects.create(username='somebody', password='something'))
@@ -47,6 +243,303 @@ def test_add_item(user_client, get_mock):
     assert EXAMPLE_COM in response.rendered_content
     assert 'example-tag' in response.rendered_content
 
+def test_add_item_fetches_in_the_background(user_client, get_mock):
+    user_client.post('/add/', {'url': EXAMPLE_COM, 'tags': 'example-tag'})
+    item = Item.objects.get()
+    assert item.status == Item.PENDING
+    assert item.title == EXAMPLE_COM
+    assert not get_mock.called
+    assert FetchJob.objects.filter(item=item).exists()
+
+    assert jobs.process_next_job()
+    item = Item.objects.get()
+    assert item.status == Item.FETCHED
+    assert get_mock.called
+    assert not FetchJob.objects.exists()
+    assert not jobs.process_next_job()
+
+def test_add_item_can_fetch_right_away(user_client, get_mock, settings):
+    settings.PYPO_FETCH_IN_BACKGROUND = False
+    user_client.post('/add/', {'url': EXAMPLE_COM, 'tags': 'example-tag'})
+    item = Item.objects.get()
+    assert item.status == Item.FETCHED
+    assert not FetchJob.objects.exists()
+
+def test_adding_a_saved_url_adds_the_tags_to_the_saved_item(user_client, user, get_mock):
+    item = Item.objects.create(url=EXAMPLE_COM, title='saved', owner=user)
+    response = user_client.post('/add/', {'url': 'HTTP://www.Example.com:80/#top', 'tags': 'again'})
+    assert response['location'].endswith(item.get_absolute_url())
+    assert Item.objects.get().tag_names == ['again']
+
+def test_abandoned_fetch_jobs_are_claimed_again(user, settings):
+    item = add_example_item(user)
+    jobs.schedule_fetch(item)
+    assert jobs.claim_job() is not None
+    # already claimed by a worker
+    assert jobs.claim_job() is None
+    settings.PYPO_FETCH_JOB_TIMEOUT = -1
+    job = jobs.claim_job()
+    assert job.item == item
+    assert job.attempts == 2
+
+def test_failing_fetch_jobs_are_retried_until_the_item_fails(user, get_mock, settings):
+    settings.PYPO_FETCH_JOB_TIMEOUT = -1
+    get_mock.return_value = Mock(headers={'content-length': 'invalid'}, status_code=200)
+    item = Item.objects.create(url=EXAMPLE_COM, title=EXAMPLE_COM, owner=user)
+    jobs.schedule_fetch(item)
+    for attempt in range(settings.PYPO_FETCH_JOB_MAX_ATTEMPTS - 1):
+        assert jobs.process_next_job()
+        assert Item.objects.get().status == Item.PENDING
+    assert jobs.process_next_job()
+    item = Item.objects.get()
+    assert (item.status, item.title, item.readable_article) == (Item.FAILED, EXAMPLE_COM, '')
+    assert not FetchJob.objects.exists()
+
+def test_fetch_jobs_keep_titles_changed_by_the_user(user, get_mock):
+    item = Item.objects.create(url=EXAMPLE_COM, title=EXAMPLE_COM, owner=user)
+    jobs.schedule_fetch(item)
+    job = jobs.claim_job()
+    # the user renames the item while the worker downloads the page
+    Item.objects.filter(pk=item.pk).update(title='renamed')
+    jobs.process_job(job)
+    item = Item.objects.get()
+    assert (item.title, item.status) == ('renamed', Item.FETCHED)
+
+def test_fetch_jobs_of_busy_domains_are_deferred(user, get_mock, settings, monkeypatch):
+    scheduler = DomainScheduler(rate=0.01, burst=1, max_wait=0)
+    monkeypatch.setattr('readme.models.domain_scheduler', scheduler)
+    scheduler.download(EXAMPLE_COM + 'other')
+    item = Item.objects.create(url=EXAMPLE_COM, title=EXAMPLE_COM, owner=user)
+    jobs.schedule_fetch(item)
+    assert jobs.process_next_job()
+    assert Item.objects.get().status == Item.PENDING
+    job = FetchJob.objects.get()
+    assert job.attempts == 0
+    assert job.started > timezone.now() - timedelta(seconds=settings.PYPO_FETCH_JOB_TIMEOUT)
+    # not claimed again before the domain has a slot
+    assert jobs.claim_job() is None
+
+def test_items_share_the_document_of_an_url(user, other_user, get_mock):
+    first = Item(url=EXAMPLE_COM, owner=user)
+    first.fetch_article()
+    first.save()
+    second = Item(url='HTTP://WWW.EXAMPLE.COM:80/#top', owner=other_user)
+    second.fetch_article()
+    second.save()
+    assert get_mock.call_count == 1
+    assert first.document == second.document == Document.objects.get()
+    assert second.status == Item.FETCHED
+    # the text is stored only once
+    assert second.readable_article == ''
+    assert second.article == first.document.readable_article
+
+def test_stale_documents_are_fetched_again(user, get_mock, settings):
+    settings.PYPO_DOCUMENT_MAX_AGE = -1
+    for _ in range(2):
+        item = Item(url=EXAMPLE_COM, owner=user)
+        item.fetch_article()
+        item.save()
+    assert get_mock.call_count == 2
+    assert Document.objects.count() == 1
+
+def test_own_article_overrides_the_document(user):
+    document = Document.objects.store(EXAMPLE_COM, 'title', '<p>shared</p>')
+    item = Item(url=EXAMPLE_COM, owner=user)
+    item.use_document(document)
+    item.save()
+    assert item.safe_text == 'shared'
+    item.article = '<p>own</p>'
+    item.save()
+    assert item.safe_text == 'own'
+    assert Document.objects.get().readable_article == '<p>shared</p>'
+
+def test_excerpt_follows_the_article(user):
+    document = Document.objects.store(EXAMPLE_COM, 'title', '<p>shared</p>')
+    item = Item(url=EXAMPLE_COM, owner=user)
+    item.use_document(document)
+    item.save()
+    assert Item.objects.get().excerpt == 'shared'
+    document.update_article('title', '<p>updated</p>')
+    assert Item.objects.get().excerpt == 'updated'
+    item.article = 'x' * 1000
+    item.save(update_fields=Item.FETCHED_FIELDS)
+    excerpt = Item.objects.get().excerpt
+    assert len(excerpt) == 250 and excerpt.startswith('xxx')
+
+def test_backfill_fills_in_missing_excerpts(user):
+    document = Document.objects.store(EXAMPLE_COM, 'title', '<p>shared</p>')
+    shared = Item(url=EXAMPLE_COM, owner=user)
+    shared.use_document(document)
+    shared.save()
+    own = Item.objects.create(url=EXAMPLE_COM, owner=user, readable_article='<p>own</p>')
+    Item.objects.update(excerpt=None)
+    call_command('backfill_items', stdout=StringIO())
+    assert Item.objects.get(pk=shared.pk).excerpt == 'shared'
+    assert Item.objects.get(pk=own.pk).excerpt == 'own'
+
+def test_lists_do_not_load_the_articles(user, user_client):
+    Item.objects.create(url=EXAMPLE_COM, title='big', owner=user, readable_article='<p>long article</p>')
+    response = user_client.get('/')
+    item, = response.context['current_item_list']
+    assert 'readable_article' not in item.__dict__
+    assert 'long article' in response.rendered_content
+
+def test_fetching_stores_a_snapshot(user, get_mock):
+    _mock_content(get_mock, content='<title>snap</title>'.encode('latin1'), content_type='text/html',
+                  encoding='latin1')
+    item = Item(url=EXAMPLE_COM, owner=user)
+    item.fetch_article()
+    item.save()
+    assert item.parser_version == PARSER_VERSION
+    dl = Document.objects.get().read_snapshot()
+    assert dl.content == b'<title>snap</title>'
+    assert dl.text == '<title>snap</title>'
+    assert dl.encoding == 'latin1'
+
+def test_refetch_items_does_not_load_the_old_articles(user, get_mock):
+    text = '<html><head><title>new</title></head><body><p>{}</p></body></html>'.format('text ' * 100)
+    _mock_content(get_mock, content=text.encode('utf-8'), content_type='text/html')
+    Item.objects.create(url=EXAMPLE_COM, title=EXAMPLE_COM, owner=user, readable_article='<p>old</p>',
+                        status=Item.FAILED)
+    stdout = StringIO()
+    with CaptureQueriesContext(connection) as captured:
+        call_command('refetch_items', workers=1, stdout=stdout)
+    assert 'Fetched 1 items, 0 failed' in stdout.getvalue()
+    item = Item.objects.get()
+    assert (item.title, item.status, item.readable_article) == ('new', Item.FETCHED, '')
+    assert 'text text' in item.article
+    assert not any('"readme_item"."readable_article"' in query['sql'] for query in captured)
+
+def test_reextract_parses_stale_snapshots_again(user, other_user, get_mock):
+    text = '<html><head><title>{}</title></head><body><p>{}</p></body></html>'
+    _mock_content(get_mock, content=text.format('old', 'text ' * 100).encode('utf-8'), content_type='text/html')
+    for owner in (user, other_user):
+        item = Item(url=EXAMPLE_COM, owner=owner)
+        item.fetch_article()
+        item.save()
+    document = Document.objects.get()
+    document.title = 'outdated'
+    document.parser_version = 0
+    document.save()
+    Item.objects.update(title='outdated', parser_version=0)
+    # the second owner changed the title
+    Item.objects.filter(owner=other_user).update(title='renamed')
+
+    call_command('reextract', processes=1, stdout=StringIO())
+    document = Document.objects.get()
+    assert document.parser_version == PARSER_VERSION
+    assert document.title == 'old'
+    assert [(item.title, item.parser_version) for item in Item.objects.order_by('id')] == [
+        ('old', PARSER_VERSION), ('renamed', PARSER_VERSION)]
+    assert get_mock.call_count == 1
+
+def test_reextract_keeps_documents_that_fail_to_parse(user, get_mock, monkeypatch):
+    text = '<html><head><title>{}</title></head><body><p>{}</p></body></html>'
+    _mock_content(get_mock, content=text.format('old', 'text ' * 100).encode('utf-8'), content_type='text/html')
+    item = Item(url=EXAMPLE_COM, owner=user)
+    item.fetch_article()
+    item.save()
+    Document.objects.update(parser_version=0)
+    Item.objects.update(parser_version=0)
+
+    def fail(tree):
+        raise ParserException('broken')
+    monkeypatch.setattr('readme.scrapers.parse_web_page', fail)
+    stdout = StringIO()
+    call_command('reextract', processes=1, stdout=stdout)
+    assert '1 failed' in stdout.getvalue()
+    document = Document.objects.get()
+    assert (document.title, document.parser_version) == ('old', 0)
+    assert 'text' in document.readable_article
+    assert Item.objects.get().parser_version == 0
+
+def test_title_is_reported_before_the_page_is_parsed(user, get_mock):
+    head = '<html><head><title>early</title></head><body>' + ' ' * download.PREFIX_LENGTH
+    _mock_chunks(get_mock, [head.encode('utf-8'), b'<p>rest</p></body></html>'], encoding='utf-8')
+    titles = []
+    item = Item(url=EXAMPLE_COM, owner=user)
+    item.fetch_article(on_title=titles.append)
+    assert titles == ['early']
+    assert item.title == 'early'
+
+def test_prefix_callback_gets_the_first_bytes_once(get_mock):
+    _mock_chunks(get_mock, [b'a' * download.PREFIX_LENGTH, b'b' * 10, b'c' * 10], encoding='ascii')
+    prefixes = []
+    dl = download.download(EXAMPLE_COM, max_content_length=download.PREFIX_LENGTH * 2,
+                           prefix_callback=prefixes.append)
+    assert prefixes == ['a' * download.PREFIX_LENGTH]
+    assert dl.text.endswith('b' * 10 + 'c' * 10)
+
+def test_backfill_fills_in_missing_domains(user):
+    items = [Item.objects.create(url=url, owner=user) for url in (EXAMPLE_COM, 'https://lwn.net/', 'foobar')]
+    Item.objects.update(domain=None, url_hash=None)
+    call_command('backfill_items', batch_size=2, stdout=StringIO())
+    assert [item.domain for item in Item.objects.order_by('id')] == ['example.com', 'lwn.net', '']
+    assert [item.url_hash for item in Item.objects.order_by('id')] == [item.url_hash for item in items]
+    assert Item.objects.saved_url(user, 'https://lwn.net/') == items[1]
+
+def test_domain_view_lists_items_of_a_domain(user, user_client):
+    item = Item.objects.create(url='https://lwn.net/Articles/1/', title='lwn', owner=user)
+    Item.objects.create(url=EXAMPLE_COM, title='example', owner=user)
+    response = user_client.get(reverse('domains', kwargs={'domain': 'LWN.net'}))
+    assert list(response.context['current_item_list']) == [item]
+    assert response.context['domain'] == 'lwn.net'
+
+def test_api_filters_by_domain(api_client, api_user):
+    Item.objects.create(url='https://lwn.net/Articles/1/', title='lwn', owner=api_user)
+    Item.objects.create(url=EXAMPLE_COM, title='example', owner=api_user)
+    response = api_client.get('/api/items/', {'domain': 'lwn.net'})
+    assert [item['title'] for item in response.data] == ['lwn']
+
+def test_api_returns_only_the_requested_fields(api_client, api_user):
+    Item.objects.create(url=EXAMPLE_COM, title='example', owner=api_user, readable_article='article')
+    response = api_client.get('/api/items/', {'fields': 'id,title'})
+    assert [set(item) for item in response.data] == [{'id', 'title'}]
+    response = api_client.get('/api/items/')
+    assert response.data[0]['readable_article'] == 'article'
+
+def _count_queries(func):
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    return len(queries)
+
+def test_listing_items_needs_the_same_queries_for_any_number_of_items(user, user_client, api_client, api_user):
+    def add_items(owner, count):
+        for i in range(count):
+            url = EXAMPLE_COM + str(i)
+            document = Document.objects.filter(url=url).first() or Document.objects.create(
+                url=url, url_hash=download.hash_url(url), title='item', readable_article='shared',
+                fetched=timezone.now(), snapshot=b'snapshot')
+            item = Item.objects.create(url=url, title='item', owner=owner, document=document)
+            item.tags.add('a', 'b')
+
+    def queries():
+        return (_count_queries(lambda: user_client.get('/')),
+                _count_queries(lambda: api_client.get('/api/items/')))
+
+    add_items(user, 2)
+    add_items(api_user, 2)
+    few = queries()
+    add_items(user, 8)
+    add_items(api_user, 8)
+    assert queries() == few
+    with CaptureQueriesContext(connection) as captured:
+        response = api_client.get('/api/items/')
+    assert {item['readable_article'] for item in response.data} == {'shared'}
+    assert not any('snapshot' in query['sql'] for query in captured)
+
+def test_tag_names_are_updated_after_prefetching(user):
+    add_example_item(user, ['old'])
+    item = Item.objects.with_tag_names().get()
+    assert item.tag_names == ['old']
+    item.tag_names = ['new']
+    assert item.tag_names == ['new']
+
+def test_normalize_url():
+    assert download.normalize_url('HTTPS://Example.com:443') == 'https://example.com/'
+    assert download.normalize_url('http://example.com:8080/a?b=c#d') == 'http://example.com:8080/a?b=c'
+    assert download.hash_url('http://EXAMPLE.com/') == download.hash_url('http://example.com')
+
 def test_long_tags_are_truncated(user, user_client):
     long_tag = 'foobar'*100
 
@@ -209,18 +702,43 @@ def test_facets_are_included_in_the_index_view(test_index, user_client, other_us
     # only his own tags are counted
     assert {(QUEEN, 3), ('fish', 2), ('pypo', 1), ('boxing', 1), ('bartender', 1)} == tags
 
-def test_index_view_is_paginated(user, user_client, tagged_items):
-    response = user_client.get('/')
-    assert isinstance(response.context['current_item_list'], Page)
-
-    p = response.context['current_item_list']
-    # start at page 1
-    assert p.number == 1
-
-    response = user_client.get('/?page=100')
-    p = response.context['current_item_list']
-    # overflowing means that we get the last page
-    assert p.number == p.paginator.num_pages
+def test_index_view_is_paginated(user, user_client):
+    user.userprofile.items_per_page = 2
+    user.userprofile.save()
+    items = [Item.objects.create(url=EXAMPLE_COM + str(i), title=str(i), owner=user) for i in range(5)]
+    # items saved in the same instant are ordered by id
+    Item.objects.filter(id__in=[item.id for item in items]).update(created=items[0].created)
+    newest_first = items[::-1]
+
+    page = user_client.get('/').context['current_item_list']
+    assert list(page) == newest_first[:2]
+    assert not page.has_previous()
+    page = user_client.get('/', {'cursor': page.next_cursor}).context['current_item_list']
+    assert list(page) == newest_first[2:4]
+    last = user_client.get('/', {'cursor': page.next_cursor}).context['current_item_list']
+    assert list(last) == newest_first[4:]
+    assert not last.has_next()
+    page = user_client.get('/', {'cursor': last.previous_cursor}).context['current_item_list']
+    assert list(page) == newest_first[2:4]
+    page = user_client.get('/', {'cursor': page.previous_cursor}).context['current_item_list']
+    assert list(page) == newest_first[:2]
+    assert not page.has_previous()
+
+    # broken cursors start at the first page
+    page = user_client.get('/', {'cursor': 'broken'}).context['current_item_list']
+    assert list(page) == newest_first[:2]
+
+def test_api_is_paginated(api_client, api_user, settings):
+    settings.PYPO_API_PAGE_SIZE = 2
+    for i in range(3):
+        Item.objects.create(url=EXAMPLE_COM + str(i), title=str(i), owner=api_user)
+    response = api_client.get('/api/items/')
+    assert [item['title'] for item in response.data] == ['2', '1']
+    next_url = re.match(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+    response = api_client.get(next_url)
+    assert [item['title'] for item in response.data] == ['0']
+    assert 'rel="prev"' in response['Link'] and 'rel="next"' not in response['Link']
+    assert api_client.get('/api/items/', {'cursor': 'broken'}).status_code == 404
 
 def test_tags_are_saved_as_a_list(user, test_index):
     item = Item.objects.create(url=EXAMPLE_COM, title='Example test',
@@ -274,6 +792,72 @@ def test_can_query_for_tags(user, test_index, tagged_items):
     searched = {result.object for result in sqs}
     assert set(tagged_items) == searched
 
+def test_index_updates_are_queued(user, test_index, settings):
+    settings.PYPO_INDEX_IN_BACKGROUND = True
+    item = Item.objects.create(url=EXAMPLE_COM, title='queued', owner=user)
+    item.tag_names = ['one', 'two']
+    item.title = 'queued again'
+    item.save()
+    # all changes of the item are indexed once
+    assert list(IndexUpdate.objects.values_list('item_id', flat=True)) == [item.id]
+    assert not SearchQuerySet().filter(owner_id=user.id).count()
+
+    assert indexing.flush_index_queue() == 1
+    result, = SearchQuerySet().filter(owner_id=user.id)
+    assert result.title == 'queued again'
+    assert sorted(result.tags) == ['one', 'two']
+    assert not IndexUpdate.objects.exists()
+
+    item.delete()
+    assert indexing.flush_index_queue() == 1
+    assert not SearchQuerySet().filter(owner_id=user.id).count()
+
+def test_items_changed_while_indexing_stay_queued(user, settings, monkeypatch):
+    settings.PYPO_INDEX_IN_BACKGROUND = True
+    item = Item.objects.create(url=EXAMPLE_COM, title='queued', owner=user)
+    update_items = indexing._update_items
+
+    def change_while_indexing(backend, index, items):
+        update_items(backend, index, items)
+        indexing.queue_index_update(item.id)
+    monkeypatch.setattr(indexing, '_update_items', change_while_indexing)
+    assert indexing.process_index_queue() == 1
+    assert IndexUpdate.objects.get().item_id == item.id
+    monkeypatch.undo()
+    assert indexing.process_index_queue() == 1
+    assert not IndexUpdate.objects.exists()
+
+def test_items_that_cannot_be_indexed_do_not_block_the_batch():
+    good, bad, also_good = Item(pk=1), Item(pk=2), Item(pk=3)
+    backend = Mock()
+    backend.update.side_effect = lambda index, items: bad in items and 1 / 0
+    indexing._update_items(backend, 'index', [good, bad, also_good])
+    assert [call[0][1] for call in backend.update.call_args_list] == [
+        [good, bad, also_good], [good], [bad], [also_good]]
+
+def test_tag_changes_modify_the_item(user):
+    item = Item.objects.create(url=EXAMPLE_COM, title='example', owner=user)
+    earlier = timezone.now() - timedelta(days=1)
+    Item.objects.update(modified=earlier)
+    item.tag_names = ['new']
+    assert Item.objects.get().modified > earlier
+    Item.objects.update(modified=earlier)
+    item.title = 'changed'
+    item.save()
+    assert Item.objects.get().modified > earlier
+
+def test_reindex_only_indexes_modified_items(user, test_index):
+    old = Item.objects.create(url=EXAMPLE_COM, title='old', owner=user)
+    new = Item.objects.create(url=EXAMPLE_COM + 'new', title='new', owner=user)
+    Item.objects.filter(pk=old.pk).update(modified=timezone.now() - timedelta(days=2))
+    call_command('clear_index', interactive=False, verbosity=0)
+    out = StringIO()
+    call_command('reindex_items', age=24, processes=1, stdout=out)
+    assert 'Indexed 1 items' in out.getvalue()
+    assert [result.pk for result in SearchQuerySet().filter(owner_id=user.id)] == [str(new.pk)]
+    assert indexing.reindex(processes=1, batch_size=1, optimize=True) == 2
+    assert SearchQuerySet().filter(owner_id=user.id).count() == 2
+
 def test_can_sort_by_creation_time(user, user_client, test_index):
     items = [add_example_item(user, ['foobar']) for _ in range(10)]
 
@@ -289,7 +873,7 @@ def test_can_sort_by_creation_time(user, user_client, test_index):
 def _mock_content(get_mock, content, content_type="", content_length=1, encoding=None):
     return_mock = Mock(headers={'content-type': content_type,
                                 'content-length': content_length},
-                       encoding=encoding)
+                       encoding=encoding, status_code=200)
     return_mock.iter_content.return_value = iter([content])
     get_mock.return_value = return_mock
 
@@ -297,18 +881,206 @@ def test_uses_request_to_start_the_download(get_mock):
     get_mock.side_effect = requests.RequestException
     with pytest.raises(download.DownloadException):
         download.download(EXAMPLE_COM)
-    get_mock.assert_called_with(EXAMPLE_COM, stream=True, verify=False)
+    get_mock.assert_called_with(EXAMPLE_COM, stream=True, verify=False, headers={}, timeout=DEFAULT_TIMEOUT)
+
+def test_sessions_are_reused_per_host(get_mock):
+    pool = download.SessionPool()
+    download.download(EXAMPLE_COM, pool=pool)
+    download.download(EXAMPLE_COM + 'other/page', pool=pool)
+    download.download('http://example.org/', pool=pool)
+    assert pool.stats() == {'hits': 1, 'misses': 2, 'evictions': 0, 'sessions': 2}
+
+def test_idle_sessions_are_evicted():
+    pool = download.SessionPool(idle_timeout=-1)
+    with pool.session(EXAMPLE_COM):
+        # sessions in use are never evicted
+        with pool.session('http://example.org/'):
+            assert pool.stats()['sessions'] == 2
+    with pool.session(EXAMPLE_COM):
+        pass
+    assert pool.stats()['evictions'] == 1
+
+def test_session_pool_is_bounded():
+    pool = download.SessionPool(max_hosts=1)
+    for host in ('http://a.example.com/', 'http://b.example.com/', 'http://c.example.com/'):
+        with pool.session(host):
+            pass
+    assert pool.stats()['sessions'] == 1
+    assert pool.stats()['evictions'] == 2
+
+def test_fetch_many_returns_all_results(get_mock):
+    get_mock.return_value.iter_content.side_effect = lambda *args: iter([b"example.com"])
+    items = [Item(url='http://host{}.example.com/'.format(i % 3)) for i in range(10)]
+    results = list(fetch_many(items, workers=4, per_host=1))
+    # unsaved items compare equal, so compare identities
+    assert sorted(id(result.item) for result in results) == sorted(id(item) for item in items)
+    assert all(result.content.text == 'example.com' for result in results)
+
+def test_fetch_many_reports_errors(get_mock):
+    get_mock.side_effect = requests.RequestException
+    result, = fetch_many([Item(url=EXAMPLE_COM)])
+    assert result.content is None
+    assert isinstance(result.error, download.DownloadException)
+
+def test_fetch_many_limits_downloads_per_host(monkeypatch):
+    lock = threading.Lock()
+    running, most_running = {}, {}
+
+    def slow_download(url, **kwargs):
+        with lock:
+            running[url] = running.get(url, 0) + 1
+            most_running[url] = max(most_running.get(url, 0), running[url])
+        time.sleep(0.01)
+        with lock:
+            running[url] -= 1
+        return download.DownloadedContent(text='', content=b'', content_type='text/html')
+
+    monkeypatch.setattr('readme.bulk.download', slow_download)
+    items = [Item(url='http://host{}.example.com/'.format(i % 2)) for i in range(12)]
+    assert len(list(fetch_many(items, workers=6, per_host=2))) == 12
+    assert max(most_running.values()) == 2
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_token_bucket_allows_bursts():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, burst=2, clock=clock)
+    assert bucket.reserve(max_wait=0) == 0
+    assert bucket.reserve(max_wait=0) == 0
+    assert bucket.reserve(max_wait=0) is None
+    assert bucket.reserve(max_wait=5) == 1
+    clock.now = 10
+    assert bucket.reserve(max_wait=0) == 0
+
+def test_scheduler_waits_for_the_rate_limit(get_mock):
+    clock = FakeClock()
+    scheduler = DomainScheduler(rate=0.5, burst=1, clock=clock, sleep=clock.sleep)
+    scheduler.download(EXAMPLE_COM)
+    assert clock.now == 0
+    scheduler.download(EXAMPLE_COM + 'other')
+    assert clock.now == 2
+    # other domains have their own limit
+    scheduler.download('http://example.org/')
+    assert clock.now == 2
+
+def test_scheduler_stops_trying_failing_domains(get_mock):
+    clock = FakeClock()
+    scheduler = DomainScheduler(failure_threshold=2, reset_timeout=60, negative_ttl=10,
+                                clock=clock, sleep=clock.sleep)
+    get_mock.side_effect = requests.Timeout
+    for page in ('a', 'b'):
+        with pytest.raises(download.DownloadException):
+            scheduler.download(EXAMPLE_COM + page)
+    assert get_mock.call_count == 2
+    with pytest.raises(download.DownloadException) as cm:
+        scheduler.download(EXAMPLE_COM + 'c')
+    assert 'Too many failures' in cm.value.message
+    assert isinstance(cm.value, download.DownloadDeferred)
+    assert cm.value.retry_after == 60
+    assert get_mock.call_count == 2
+
+    # after the timeout, one request is let through and closes the circuit again
+    clock.now = 60
+    get_mock.side_effect = None
+    scheduler.download(EXAMPLE_COM + 'c')
+    scheduler.download(EXAMPLE_COM + 'd')
+    assert get_mock.call_count == 4
+
+def test_scheduler_closes_the_circuit_after_a_probe_with_unusable_content(get_mock):
+    clock = FakeClock()
+    scheduler = DomainScheduler(failure_threshold=1, reset_timeout=10, clock=clock, sleep=clock.sleep)
+    get_mock.side_effect = requests.Timeout
+    with pytest.raises(download.DownloadException):
+        scheduler.download(EXAMPLE_COM + 'a')
+    clock.now = 10
+    get_mock.side_effect = None
+    get_mock.return_value.headers['content-length'] = 10 ** 9
+    with pytest.raises(download.DownloadException) as cm:
+        scheduler.download(EXAMPLE_COM + 'b')
+    assert not isinstance(cm.value, download.DownloadDeferred)
+    clock.now = 11
+    get_mock.return_value.headers['content-length'] = 10
+    scheduler.download(EXAMPLE_COM + 'c')
+
+def test_scheduler_remembers_failed_urls(get_mock):
+    clock = FakeClock()
+    scheduler = DomainScheduler(negative_ttl=10, clock=clock, sleep=clock.sleep)
+    get_mock.return_value.status_code = 503
+    with pytest.raises(download.DownloadException) as cm:
+        scheduler.download(EXAMPLE_COM)
+    assert cm.value.status_code == 503
+    with pytest.raises(download.DownloadException) as cm:
+        scheduler.download(EXAMPLE_COM)
+    assert 'Recently failed' in cm.value.message
+    assert get_mock.call_count == 1
+    clock.now = 10
+    get_mock.return_value.status_code = 200
+    scheduler.download(EXAMPLE_COM)
+    assert get_mock.call_count == 2
+
+def test_scheduler_ignores_client_errors(get_mock):
+    scheduler = DomainScheduler(failure_threshold=1)
+    get_mock.return_value.headers['content-length'] = 'invalid'
+    for _ in range(2):
+        with pytest.raises(download.DownloadException) as cm:
+            scheduler.download(EXAMPLE_COM)
+        assert 'convert' in cm.value.message
+    assert get_mock.call_count == 2
+
+def test_refetch_sends_a_conditional_request(get_mock, tmpdir):
+    cache = download.ResponseCache(str(tmpdir))
+    content = '<title>cached</title>'.encode('utf-8')
+    _mock_content(get_mock, content=content, content_type='text/html', encoding='utf-8')
+    get_mock.return_value.headers.update({'etag': '"abc"', 'last-modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+    first = download.download(EXAMPLE_COM, cache=cache)
+    get_mock.assert_called_with(EXAMPLE_COM, stream=True, verify=False, headers={}, timeout=DEFAULT_TIMEOUT)
+
+    get_mock.return_value = Mock(headers={}, status_code=304)
+    second = download.download(EXAMPLE_COM, cache=cache)
+    get_mock.assert_called_with(EXAMPLE_COM, stream=True, verify=False, headers={
+        'If-None-Match': '"abc"', 'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'},
+        timeout=DEFAULT_TIMEOUT)
+    assert not get_mock.return_value.iter_content.called
+    assert second == first
+    assert second.text == '<title>cached</title>'
+
+def test_response_cache_evicts_the_least_recently_used_pages(tmpdir):
+    cache = download.ResponseCache(str(tmpdir), max_entries=10)
+    req = Mock(headers={'etag': '"abc"'}, status_code=200, encoding='utf-8')
+    dl = download.DownloadedContent(content=b'page', text='page', content_type='text/html')
+    urls = [EXAMPLE_COM + str(number) for number in range(11)]
+    for age, url in enumerate(urls[:10]):
+        cache.store(url, req, dl)
+        os.utime(cache._path(url), (age, age))
+    # used recently, the second and third page are the oldest now
+    assert cache.get(urls[0]) is not None
+    cache.store(urls[10], req, dl)
+    assert [cache.get(url) is not None for url in urls] == [True, False, False] + [True] * 8
+
+def test_responses_without_validators_are_not_cached(get_mock, tmpdir):
+    cache = download.ResponseCache(str(tmpdir))
+    _mock_content(get_mock, content=b'uncached', content_type='text/html', encoding='utf-8')
+    download.download(EXAMPLE_COM, cache=cache)
+    assert cache.get(EXAMPLE_COM) is None
 
 def test_aborts_large_downloads(get_mock):
     max_length = 1000
-    return_mock = Mock(headers={'content-length': max_length+1})
+    return_mock = Mock(headers={'content-length': max_length+1}, status_code=200)
     get_mock.return_value = return_mock
     with pytest.raises(download.DownloadException) as cm:
         download.download(EXAMPLE_COM, max_length)
     assert 'content-length' in cm.value.message
 
 def test_aborts_with_invalid_headers(get_mock):
-    return_mock = Mock(headers={'content-length': "invalid"})
+    return_mock = Mock(headers={'content-length': "invalid"}, status_code=200)
     get_mock.return_value = return_mock
     with pytest.raises(download.DownloadException) as cm:
         download.download(EXAMPLE_COM)
@@ -317,7 +1089,7 @@ def test_aborts_with_invalid_headers(get_mock):
     assert isinstance(cm.value.parent, ValueError)
 
 def test_item_model_handles_error(get_mock, user):
-    return_mock = Mock(headers={'content-length': "invalid"})
+    return_mock = Mock(headers={'content-length': "invalid"}, status_code=200)
     get_mock.return_value = return_mock
 
     item = Item()
@@ -325,23 +1097,57 @@ def test_item_model_handles_error(get_mock, user):
     item.owner = user
     item.fetch_article()
     assert item.title == EXAMPLE_COM
-    assert item.readable_article is None
+    assert item.readable_article == ''
+
+def _mock_chunks(get_mock, chunks, content_type='text/html', encoding=None):
+    _mock_content(get_mock, content=None, content_type=content_type, encoding=encoding)
+    get_mock.return_value.iter_content.return_value = iter(chunks)
 
 def test_only_downloads_up_to_a_maximum_length(get_mock):
-    content = Mock()
-    max_length = 1
-    _mock_content(get_mock, content=content, content_length=max_length)
+    max_length = 5
+    _mock_chunks(get_mock, [b'abc', b'def', b'ghi'], encoding='ascii')
     ret = download.download(EXAMPLE_COM, max_content_length=max_length)
-    get_mock.return_value.iter_content.assert_called_with(max_length)
-    assert ret.content == content
+    assert ret.content == b'abcde'
+    assert ret.text == 'abcde'
 
 def test_decodes_text_content(get_mock):
-    content, encoding = Mock(), Mock()
-    content.decode.return_value = 'text'
+    content, encoding = 'fübar'.encode('latin1'), 'latin1'
     _mock_content(get_mock, content=content, content_type='text/html', encoding=encoding)
     ret = download.download(EXAMPLE_COM)
-    content.decode.assert_called_with(encoding, errors='ignore')
-    assert 'text' == ret.text
+    assert 'fübar' == ret.text
+
+def test_decodes_characters_split_between_chunks(get_mock):
+    content = ('<meta charset="utf-8">' + 'ü' * download.SNIFF_LENGTH).encode('utf-8')
+    chunks = [content[i:i + 1001] for i in range(0, len(content), 1001)]
+    _mock_chunks(get_mock, chunks, encoding='latin1')
+    ret = download.download(EXAMPLE_COM, max_content_length=len(content))
+    assert ret.text == content.decode('utf-8')
+
+def test_charset_is_only_searched_at_the_beginning(get_mock):
+    content = ('fübar' + ' ' * download.SNIFF_LENGTH + '<meta charset="ascii">').encode('latin1')
+    _mock_content(get_mock, content=content, content_type='text/html', encoding='latin1')
+    ret = download.download(EXAMPLE_COM, max_content_length=len(content))
+    assert ret.text.startswith('fübar')
+
+def test_does_not_download_binary_content(get_mock):
+    _mock_content(get_mock, content=b'binary', content_type='image/png')
+    ret = download.download(EXAMPLE_COM)
+    assert not get_mock.return_value.iter_content.called
+    assert ret.content is None
+    assert ret.content_type == 'image/png'
+
+def test_only_downloads_the_beginning_of_pdfs(get_mock):
+    _mock_content(get_mock, content=None, content_type='application/pdf', content_length=10 ** 9)
+    chunks = [b'%PDF' * (download.CHUNK_SIZE // 4)] * 100
+    get_mock.return_value.iter_content.return_value = iter(chunks)
+    ret = download.download(EXAMPLE_COM, max_content_length=10 ** 6)
+    assert ret.content == b''.join(chunks)[:download.PREFIX_TYPES['application/pdf']]
+    assert ret.text is None
+
+def test_json_and_xml_are_text():
+    assert download.is_text('application/json; charset=utf-8')
+    assert download.is_text('application/xhtml+xml')
+    assert not download.is_text('application/pdf')
 
 def test_guess_encoding_from_content(get_mock):
     content = '<meta charset="UTF-8"/>fübar'
@@ -364,7 +1170,7 @@ def test_only_decodes_text_content(get_mock):
     assert None == ret.text
 
 def test_can_handle_empty_content(get_mock):
-    return_mock = Mock(headers={'content-type': 'text/html'})
+    return_mock = Mock(headers={'content-type': 'text/html'}, status_code=200)
     return_mock.iter_content.return_value = iter([])
     get_mock.return_value = return_mock
 
@@ -372,6 +1178,157 @@ def test_can_handle_empty_content(get_mock):
     # expect the empty fallback text because we couldn't download content
     assert None == ret.text
 
+def _slow_chunks(clock, chunks, seconds_per_chunk):
+    for chunk in chunks:
+        clock.now += seconds_per_chunk
+        yield chunk
+
+def test_timeouts_are_limited_by_the_deadline(get_mock):
+    clock = FakeClock()
+    deadline = download.Deadline(5, clock=clock)
+    download.download(EXAMPLE_COM, deadline=deadline)
+    assert get_mock.call_args[1]['timeout'] == (5, 5)
+
+def test_deadline_returns_partial_content(get_mock):
+    clock = FakeClock()
+    _mock_chunks(get_mock, [])
+    get_mock.return_value.iter_content.return_value = _slow_chunks(clock, [b'<title>slow</title>', b'abc', b'def'], 1)
+    ret = download.download(EXAMPLE_COM, deadline=download.Deadline(2, clock=clock), min_partial_length=10)
+    assert ret.partial
+    assert ret.content == b'<title>slow</title>abc'
+
+def test_deadline_fails_without_enough_content(get_mock):
+    clock = FakeClock()
+    _mock_chunks(get_mock, [])
+    get_mock.return_value.iter_content.return_value = _slow_chunks(clock, [b'abc', b'def'], 1)
+    with pytest.raises(download.DownloadException) as cm:
+        download.download(EXAMPLE_COM, deadline=download.Deadline(1, clock=clock), min_partial_length=10)
+    assert cm.value.is_host_failure
+
+@pytest.fixture
+def cookie_server(request, monkeypatch):
+    """
+    Url of a local server. /login sets a cookie and redirects to /page, which answers with
+    the cookies it got.
+    """
+    for name in ('http_proxy', 'HTTP_PROXY', 'all_proxy', 'ALL_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/login':
+                self.send_response(302)
+                self.send_header('Set-Cookie', 'user=alice; Path=/')
+                self.send_header('Location', '/page')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = 'cookies: {}'.format(self.headers.get('Cookie', '')).encode('ascii')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def fin():
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    request.addfinalizer(fin)
+    return 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+def test_pooled_sessions_do_not_keep_cookies(cookie_server):
+    pool = download.SessionPool()
+    assert download.download(cookie_server + 'login', pool=pool).text == 'cookies: user=alice'
+    assert download.download(cookie_server + 'page', pool=pool).text == 'cookies: '
+
+@pytest.fixture
+def trickling_server(request, monkeypatch):
+    """
+    Url of a local server that sends a long page ten bytes at a time
+    """
+    for name in ('http_proxy', 'HTTP_PROXY', 'all_proxy', 'ALL_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    stop = threading.Event()
+
+    def serve():
+        connection, _ = listener.accept()
+        try:
+            connection.recv(4096)
+            connection.sendall(b'HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 100000\r\n\r\n')
+            while not stop.wait(0.05):
+                connection.sendall(b'<p>slow</p>'[:10])
+        except OSError:
+            pass
+        finally:
+            connection.close()
+    server = threading.Thread(target=serve)
+    server.start()
+
+    def fin():
+        stop.set()
+        server.join()
+        listener.close()
+    request.addfinalizer(fin)
+    return 'http://127.0.0.1:{}/'.format(listener.getsockname()[1])
+
+def test_deadline_cuts_off_a_trickling_server(trickling_server):
+    started = time.monotonic()
+    ret = download.download(trickling_server, max_content_length=10 ** 6, pool=download.SessionPool(),
+                            deadline=download.Deadline(1), min_partial_length=10)
+    assert time.monotonic() - started < 3
+    assert ret.partial
+    assert ret.content.startswith(b'<p>slow</p')
+
+def test_deadline_fails_a_trickling_server_without_enough_content(trickling_server):
+    started = time.monotonic()
+    with pytest.raises(download.DownloadException) as cm:
+        download.download(trickling_server, max_content_length=10 ** 6, pool=download.SessionPool(),
+                          deadline=download.Deadline(1), min_partial_length=10 ** 5)
+    assert time.monotonic() - started < 3
+    assert cm.value.is_host_failure
+
+def test_read_timeouts_keep_the_content_that_arrived(get_mock):
+    def chunks():
+        yield b'<title>slow</title>'
+        raise requests.Timeout()
+    _mock_chunks(get_mock, [])
+    get_mock.return_value.iter_content.return_value = chunks()
+    ret = download.download(EXAMPLE_COM, min_partial_length=10)
+    assert ret.partial
+    assert ret.text == '<title>slow</title>'
+
+def test_partial_content_is_parsed(get_mock, db, settings):
+    settings.PYPO_FETCH_MIN_PARTIAL_LENGTH = 10
+    clock = FakeClock()
+    _mock_chunks(get_mock, [], encoding='utf-8')
+    get_mock.return_value.iter_content.return_value = _slow_chunks(clock, [b'<html><head><title>slow</title>', b'<body>'], 1)
+    item = Item(url=EXAMPLE_COM)
+    item.fetch_article(deadline=download.Deadline(1, clock=clock))
+    assert item.title == 'slow'
+    assert item.status == Item.FETCHED
+
+def test_partial_content_is_not_cached(get_mock, tmpdir):
+    cache = download.ResponseCache(str(tmpdir))
+    def chunks():
+        yield b'<title>slow</title>'
+        raise requests.ConnectionError()
+    _mock_chunks(get_mock, [])
+    get_mock.return_value.headers['etag'] = '"abc"'
+    get_mock.return_value.iter_content.return_value = chunks()
+    download.download(EXAMPLE_COM, cache=cache, min_partial_length=10)
+    assert cache.get(EXAMPLE_COM) is None
+
 
 def test_can_list_all_items(api_client, api_user):
     item = Item.objects.create(url=EXAMPLE_COM, title='nothing', owner=api_user)
@@ -381,9 +1338,9 @@ def test_can_list_all_items(api_client, api_user):
     response.data[1].pop('id')
     assert list(map(dict, response.data)) == [
         {'url': 'something.local', 'title': 'nothing',
-         'created': item2.created_as_str, 'readable_article': '', 'tags': []},
+         'created': item2.created_as_str, 'readable_article': '', 'tags': [], 'status': 'fetched'},
         {'url': 'http://www.example.com/', 'title': 'nothing',
-         'created': item.created_as_str, 'readable_article': '', 'tags': []},
+         'created': item.created_as_str, 'readable_article': '', 'tags': [], 'status': 'fetched'},
     ]
 
 def test_can_update_item(api_client, api_user):
@@ -439,6 +1396,13 @@ def test_items_are_searchable(api_client, api_user):
     sqs = SearchQuerySet().filter(owner_id=api_user.id).auto_query('second-tag')
     assert sqs.count() == 1, 'New item is not in the searchable by tag'
 
+def test_api_reports_the_fetch_status(api_client, api_user, get_mock):
+    response = api_client.post('/api/items/', {'url': EXAMPLE_COM, 'tags': []}, format='json')
+    assert response.data['status'] == Item.PENDING
+    jobs.process_next_job()
+    response = api_client.get('/api/items/{}/'.format(response.data['id']))
+    assert response.data['status'] == Item.FETCHED
+
 def test_item_form_allows_tags_with_spaces():
     form = CreateItemForm({'url': EXAMPLE_COM, 'tags': 'i have spaces, foo'}, instance=Item())
     assert form.is_valid()
@@ -1,4 +1,3 @@
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.template.response import TemplateResponse
 from django.views import generic
 from django.conf import settings
@@ -7,7 +6,9 @@ from haystack.query import SearchQuerySet
 from haystack.views import FacetedSearchView, search_view_factory
 from sitegate.models import InvitationCode
 from sitegate.signup_flows.modern import InvitationSignup
-from .models import Item, UserProfile
+from .models import Item, UserProfile, UserTagCount, changing_tags
+from .jobs import schedule_fetch
+from .pagination import paginate, InvalidCursor
 from .forms import CreateItemForm, UpdateItemForm, UserProfileForm, SearchForm
 from django.http import HttpResponseRedirect
 from django.core.urlresolvers import reverse_lazy, reverse
@@ -45,30 +46,45 @@ class RestrictItemAccessMixin(object):
 @login_required
 @ensure_csrf_cookie
 def index(request):
-    profile = request.user.userprofile
+    queryset = Item.objects.filter(owner=request.user)
+    return _item_list(request, queryset, all_items=True)
 
-    queryset = Item.objects.filter(owner=request.user).order_by('-created').prefetch_related('tags')
-    sqs = SearchQuerySet().filter(owner_id=request.user.id)
 
-    if not profile.show_excluded:
-        excluded_tags = profile.excluded_tags.names()
+@login_required
+@ensure_csrf_cookie
+def domains(request, domain):
+    domain = domain.lower()
+    queryset = Item.objects.filter(owner=request.user, domain=domain)
+    return _item_list(request, queryset, {'domain': domain})
+
+
+def _item_list(request, queryset, extra_context=None, all_items=False):
+    """
+    Paginated list of items with the tags of all listed items
+
+    :param queryset: Items of the current user
+    :param extra_context: dict
+    :param all_items: True if queryset contains all items of the user, their tags are counted already
+    """
+    profile = request.user.userprofile
+    excluded_tags = [] if profile.show_excluded else profile.excluded_tags.names()
+    if excluded_tags:
         queryset = queryset.without(*excluded_tags)
-        for tag in excluded_tags:
-            sqs = sqs.exclude(tags__in=[tag])
 
-    facets = sqs.facet('tags').facet_counts()
-    tag_objects = []
-    for name, count in facets.get('fields', {}).get('tags', []):
-        if name is not None:
-            tag_objects.append(Tag(name, count, []))
+    if all_items and not excluded_tags:
+        tag_counts = UserTagCount.objects.for_user(request.user)
+    else:
+        tag_counts = queryset.tag_counts()
+    tag_objects = [Tag(name, count, []) for name, count in tag_counts]
+    queryset = queryset.with_tag_names().for_list()
 
-    paginator = Paginator(queryset, profile.items_per_page)
     try:
-        page = paginator.page(request.GET.get('page'))
-    except PageNotAnInteger:
-        page = paginator.page(1)
-    except EmptyPage:
-        page = paginator.page(paginator.num_pages)
+        page = paginate(queryset, request.GET.get('cursor'), profile.items_per_page)
+    except InvalidCursor:
+        page = None
+    if page is None or not page.items:
+        # start over if the cursor is broken or all items after it are gone
+        page = paginate(queryset, None, profile.items_per_page)
     context = {
         'item_list': queryset,
         'tags': tag_objects,
@@ -76,6 +92,7 @@ def index(request):
         'current_item_list': page,
         'user': request.user,
     }
+    context.update(extra_context or {})
     return TemplateResponse(request, 'readme/item_list.html', context)
 
 
@@ -104,27 +121,16 @@ def tags(request, tags=''):
         return redirect(reverse('index'))
     tag_list = [tag for tag in tags.split(',') if tag != '']
 
-    # Due to a bug (or feature?) in Whoosh or haystack, we can't filter for all tags at once,
-    # the .filter(tags=[...]) method cannot handle spaces apparently
-    # It however works with tags__in, but that is an OR
-    sqs = SearchQuerySet().filter(owner_id=request.user.id)
-    for tag in tag_list:
-        sqs = sqs.filter(tags__in=[tag])
-
     profile = request.user.userprofile
+    # filtered in the database, the cost of the query does not grow with the number of tags
+    queryset = Item.objects.filter(owner=request.user).tagged(*tag_list)
 
     if not profile.show_excluded:
-        excluded_tags = profile.excluded_tags.names()
-        for tag in excluded_tags:
-            sqs = sqs.exclude(tags__in=[tag])
-
-    sqs = sqs.order_by('-created').facet('tags')
+        queryset = queryset.without(*profile.excluded_tags.names())
 
-    facets = sqs.facet_counts()
-    result_objects = [result.object for result in sqs]
-    tag_objects = [Tag(name, count, tag_list) for name, count in facets.get('fields', {}).get('tags', [])]
+    tag_objects = [Tag(name, count, tag_list) for name, count in queryset.tag_counts()]
     return TemplateResponse(request, 'readme/item_list.html', {
-        'current_item_list': result_objects,
+        'current_item_list': queryset.order_by('-created').with_tag_names().for_list(),
         'tags': tag_objects,
         'tag_names': json.dumps([tag.name for tag in tag_objects]),
         'user': request.user,
@@ -136,10 +142,7 @@ class TagNamesToContextMixin:
     def get_context_data(self, **kwargs):
         context = super(TagNamesToContextMixin, self).get_context_data(**kwargs)
 
-        sqs = SearchQuerySet().filter(owner_id=self.request.user.id).facet('tags')
-
-        facets = sqs.facet_counts()
-        tags = [name for name, count in facets.get('fields', {}).get('tags', []) if name is not None]
+        tags = [name for name, count in UserTagCount.objects.for_user(self.request.user)]
         context['tag_names'] = json.dumps(tags)
         return context
 
@@ -151,11 +154,6 @@ class UpdateItemView(TagNamesToContextMixin, RestrictItemAccessMixin, generic.Up
 
     form_class = UpdateItemForm
 
-    def form_valid(self, form):
-        self.object = form.save()
-        self.object.save()
-        return HttpResponseRedirect(self.get_success_url())
-
 
 class UpdateUserProfileView(TagNamesToContextMixin, LoginRequiredMixin, generic.UpdateView):
     model = UserProfile
@@ -186,19 +184,19 @@ class AddView(TagNamesToContextMixin, LoginRequiredMixin, generic.CreateView):
     def form_valid(self, form):
         self.object = form.save(commit=False)
 
-        duplicates = Item.objects.filter(owner=self.request.user, url=self.object.url)
-        if duplicates.count():
-            duplicate = duplicates[0]
-            duplicate.tags.add(*form.cleaned_data["tags"])
-            # additional save to update the search index
-            duplicate.save()
+        duplicate = Item.objects.saved_url(self.request.user, self.object.url)
+        if duplicate is not None:
+            with changing_tags(duplicate):
+                duplicate.tags.add(*form.cleaned_data["tags"])
             return HttpResponseRedirect(duplicate.get_absolute_url())
         self.object.owner = self.request.user
-        self.object.fetch_article()
-        self.object.save()
-        form.save_m2m()
-        # additional save to update the search index
+        # the title is filled in as soon as the article is fetched
+        self.object.title = self.object.url
+        self.object.status = Item.PENDING
         self.object.save()
+        with changing_tags(self.object):
+            form.save_m2m()
+        schedule_fetch(self.object)
         return HttpResponseRedirect(self.get_success_url())
 
     def get_initial(self):